@@ -0,0 +1,215 @@
+"""An asyncio based API for managing many services concurrently.
+
+This requires Python 3.5 or above.
+"""
+import asyncio
+import functools
+
+from . import utils
+from . import probes
+from . import constants
+from . import profiling
+from .serv import Serv, logger
+from .exceptions import ServError
+
+
+class AsyncServ(object):
+    def __init__(self,
+                 init_system=None,
+                 verbose=False,
+                 concurrency=constants.DEFAULT_ASYNC_CONCURRENCY):
+        """An asyncio counterpart of `Serv`.
+
+        Actions which the init system performs using a single command
+        (e.g. `systemctl start`) run as asyncio subprocesses. Everything
+        else (e.g. generating and deploying files) runs in the event loop's
+        default executor.
+
+        At most `concurrency` subprocesses and executor calls run at any
+        given time which allows fanning out actions across many services
+        from a single event loop. For instance:
+
+            aserv = AsyncServ(concurrency=16)
+            await asyncio.gather(*[aserv.restart(name) for name in names])
+        """
+        self._serv = Serv(init_system, verbose=verbose)
+        self.init_system = self._serv.init_system
+        self.concurrency = concurrency
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # The semaphore is created lazily as, before Python 3.10, it is bound
+        # to the event loop which is current when it's created.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def generate(self,
+                       cmd,
+                       name='',
+                       overwrite=False,
+                       deploy=False,
+                       start=False,
+                       **params):
+        """Generate service files and returns a list of the generated files.
+
+        See `Serv.generate` for more information.
+        """
+        serv = self._serv
+        name = name or serv._set_service_name_from_command(cmd)
+        init = serv._create_implementation(
+            serv._get_service_params(cmd, name, params))
+
+        files = await self._run_in_executor(
+            serv._generate_files, init, overwrite)
+        if deploy or start:
+            await self._run_in_executor(serv._deploy, init)
+            if start:
+                logger.info(
+                    'Starting %s service %s...', self.init_system, name)
+                await self._perform(init, 'start')
+                if init.params.get('probe'):
+                    await self._run_in_executor(
+                        probes.wait, init.params['probe'], name)
+            logger.info('Service created')
+        return files
+
+    async def remove(self, name):
+        """Stop and uninstall a service.
+        """
+        init = await self._get_installed_implementation(name)
+        logger.info('Removing %s service %s...', self.init_system, name)
+        await self._perform(init, 'stop')
+        await self._run_in_executor(init.uninstall)
+        logger.info('Service removed')
+
+    async def status(self, name='', names=None):
+        """Return the status of the `name` service, of the `names` services
+        or of all services.
+
+        See `Serv.status` for more information.
+        """
+        if name and not utils.is_glob(name):
+            init = await self._get_installed_implementation(name)
+        else:
+            init = self._get_implementation(name)
+        return await self._run_in_executor(
+            functools.partial(init.status, name, names=names))
+
+    async def start(self,
+                    name,
+                    wait=False,
+                    timeout=constants.DEFAULT_WAIT_TIMEOUT):
+        """Start a service
+
+        If `wait` is True, wait up to `timeout` seconds for the service
+        to start.
+        """
+        init = await self._get_installed_implementation(name)
+        logger.info('Starting service: %s...', name)
+        await self._perform(init, 'start')
+        if wait:
+            await self._wait_for_state(init, True, timeout)
+
+    async def stop(self,
+                   name,
+                   wait=False,
+                   timeout=constants.DEFAULT_WAIT_TIMEOUT):
+        """Stop a service
+
+        If `wait` is True, wait up to `timeout` seconds for the service
+        to stop.
+        """
+        init = await self._get_installed_implementation(name)
+        logger.info('Stopping service: %s...', name)
+        await self._perform(init, 'stop')
+        if wait:
+            await self._wait_for_state(init, False, timeout)
+
+    async def restart(self,
+                      name,
+                      wait=False,
+                      timeout=constants.DEFAULT_WAIT_TIMEOUT):
+        """Restart a service
+
+        If the init system can't restart the service using a single command,
+        the service is stopped and is started once it has actually stopped.
+        If `wait` is True, also wait up to `timeout` seconds for the service
+        to start.
+        """
+        init = await self._get_installed_implementation(name)
+        logger.info('Restarting service: %s...', name)
+        if init.get_command('restart'):
+            await self._perform(init, 'restart')
+        else:
+            await self._perform(init, 'stop')
+            await self._wait_for_state(init, False, timeout)
+            await self._perform(init, 'start')
+        if wait:
+            await self._wait_for_state(init, True, timeout)
+
+    async def reload(self, name):
+        """Reload a service's configuration without restarting it
+        """
+        init = await self._get_installed_implementation(name)
+        logger.info('Reloading service: %s...', name)
+        await self._perform(init, 'reload')
+
+    def _get_implementation(self, name):
+        # Unlike `Serv._get_implementation`, this doesn't update the shared
+        # params as multiple services are handled concurrently.
+        return self._serv._create_implementation(
+            dict(self._serv.params, name=name))
+
+    async def _get_installed_implementation(self, name):
+        init = self._get_implementation(name)
+        await self._run_in_executor(Serv._assert_service_installed, init, name)
+        return init
+
+    async def _run_in_executor(self, func, *args):
+        async with self.semaphore:
+            return await asyncio.get_event_loop().run_in_executor(
+                None, functools.partial(func, *args))
+
+    async def _perform(self, init, action):
+        """Perform `action` on the service using the init system's command
+        for it or, if there is none, using the implementation's method.
+        """
+        command = init.get_command(action)
+        if not command:
+            return await self._run_in_executor(getattr(init, action))
+
+        async with self.semaphore:
+            logger.debug('Running %s...', ' '.join(command))
+            with profiling.timer(command[0], ' '.join(command[1:])):
+                proc = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE)
+                _, err = await proc.communicate()
+        tolerated = init.tolerated_return_codes.get(action, ())
+        if proc.returncode != 0 and proc.returncode not in tolerated:
+            raise ServError('Failed to {0} service {1}: {2}'.format(
+                action, init.name, err.decode('utf-8', 'replace').strip()))
+
+    async def _wait_for_state(self,
+                              init,
+                              running,
+                              timeout,
+                              interval=0.1,
+                              max_interval=2):
+        """Asynchronously do what `Base.wait_for_state` does.
+        """
+        state = 'start' if running else 'stop'
+        logger.debug('Waiting for service %s to %s...', init.name, state)
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while await self._run_in_executor(init.is_running) != running:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise ServError(
+                    'Service {0} did not {1} within {2} seconds'.format(
+                        init.name, state, timeout))
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, max_interval)
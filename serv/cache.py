@@ -0,0 +1,152 @@
+"""A local cache of rendered templates.
+
+The cache is disabled unless the `SERV_RENDER_CACHE` env var is set. As
+rendered files may contain secrets (e.g. env vars), the cache directory
+and its entries are only accessible by their owner.
+
+Each rendered template is stored under `<cache dir>/render` in a file
+named after a hash of the template's content and of the parameters it was
+rendered with. As changing either results in a different key, entries never
+have to be invalidated. Instead, once the cache grows beyond
+`RENDER_CACHE_MAX_ENTRIES`, the least recently used entries are evicted.
+"""
+import os
+import json
+import time
+import shutil
+import threading
+
+from . import utils
+from . import constants
+
+
+_lock = threading.Lock()
+# The number of entries in each render cache directory, counted once
+# per process when first writing to it.
+_entries = {}
+_template_hashes = {}
+_encoder = json.JSONEncoder(sort_keys=True, default=str)
+# Entries are marked as used at most once in this many seconds as updating
+# their modification time on every use is relatively expensive.
+_TOUCH_INTERVAL = 60
+
+
+def is_enabled():
+    return bool(os.environ.get(constants.ENABLE_RENDER_CACHE_ENV_VAR))
+
+
+def get_key(template_path, params):
+    """Return the key of the template in `template_path` rendered
+    with `params`.
+    """
+    import hashlib
+
+    template_hash = _template_hashes.get(template_path)
+    if template_hash is None:
+        template_hash = utils.get_file_hash(template_path)
+        _template_hashes[template_path] = template_hash
+    content = '{0}:{1}'.format(template_hash, _encoder.encode(params))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def get(key):
+    """Return the rendered template cached under `key` or None if it
+    isn't cached.
+    """
+    path = os.path.join(_get_cache_dir(), key)
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+            # The modification time is used to evict the least recently
+            # used entries.
+            if os.fstat(f.fileno()).st_mtime < time.time() - _TOUCH_INTERVAL:
+                os.utime(path, None)
+    except (IOError, OSError):
+        return None
+    return content.decode('utf-8')
+
+
+def put(key, content):
+    """Cache the rendered template `content` under `key` and evict the
+    least recently used entries if the cache is full.
+    """
+    cache_dir = _get_cache_dir()
+    path = os.path.join(cache_dir, key)
+    utils.makedirs(cache_dir, 0o700)
+    tmp_path = '{0}.{1}.{2}.tmp'.format(
+        path, os.getpid(), threading.current_thread().ident)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content.encode('utf-8'))
+    os.rename(tmp_path, path)
+
+    with _lock:
+        if cache_dir not in _entries:
+            _entries[cache_dir] = len(_list_entries(cache_dir))
+        else:
+            _entries[cache_dir] += 1
+        if _entries[cache_dir] > constants.RENDER_CACHE_MAX_ENTRIES:
+            # Evicting a bit more than required means we don't have to
+            # evict again on the next write.
+            _entries[cache_dir] = _evict(
+                cache_dir, int(constants.RENDER_CACHE_MAX_ENTRIES * 0.9))
+
+
+def clear():
+    """Remove everything Serv caches and return the removed paths.
+
+    This includes rendered templates, the detected init system and,
+    if `SERV_TEMPLATE_CACHE_DIR` is set, compiled templates.
+    """
+    removed = []
+    render_dir = _get_cache_dir()
+    if os.path.isdir(render_dir):
+        shutil.rmtree(render_dir)
+        removed.append(render_dir)
+    with _lock:
+        _entries.pop(render_dir, None)
+
+    init_system_cache = utils.get_cache_dir(constants.INIT_SYSTEM_CACHE_FILE)
+    if os.path.isfile(init_system_cache):
+        os.remove(init_system_cache)
+        removed.append(init_system_cache)
+
+    bytecode_dir = os.environ.get(constants.TEMPLATE_CACHE_DIR_ENV_VAR)
+    if bytecode_dir and os.path.isdir(bytecode_dir):
+        import jinja2
+
+        # This only removes compiled templates and not any other files
+        # which may be in the directory.
+        jinja2.FileSystemBytecodeCache(bytecode_dir).clear()
+        removed.append(bytecode_dir)
+    return removed
+
+
+def _get_cache_dir():
+    return utils.get_cache_dir(constants.RENDER_CACHE_DIR)
+
+
+def _list_entries(cache_dir):
+    return [name for name in os.listdir(cache_dir)
+            if not name.endswith('.tmp')]
+
+
+def _evict(cache_dir, keep):
+    """Remove all but the `keep` most recently used entries in `cache_dir`
+    and return the number of remaining entries.
+    """
+    entries = []
+    for name in _list_entries(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            # Evicted by another process.
+            pass
+    entries.sort(reverse=True)
+    for _, path in entries[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return min(len(entries), keep)
@@ -6,12 +6,80 @@
 
 SYSTEMD_SVC_PATH = '/lib/systemd/system'
 SYSTEMD_ENV_PATH = '/etc/sysconfig'
+# Drop-ins (e.g. the CPU affinity of instances of template units) are
+# written under this directory.
+SYSTEMD_DROP_IN_PATH = '/etc/systemd/system'
+SYSTEMD_CPU_AFFINITY_DROP_IN = 'serv-cpu-affinity.conf'
 UPSTART_SVC_PATH = '/etc/init'
 SYSV_SVC_PATH = '/etc/init.d'
 SYSV_ENV_PATH = '/etc/default'
+SYSV_PID_PATH = '/var/run'
+PROC_PATH = '/proc'
+CGROUP_PATH = '/sys/fs/cgroup'
 NSSM_BINARY_PATH = 'c:\\nssm'
 NSSM_SVC_PATH = 'c:\\nssm'
 
+# If set, compiled templates are persisted to this directory and reused
+# across invocations.
+TEMPLATE_CACHE_DIR_ENV_VAR = 'SERV_TEMPLATE_CACHE_DIR'
+
+# Number of services handled concurrently by `apply`.
+DEFAULT_APPLY_JOBS = 8
+
+# Seconds to wait for a service to start or stop.
+DEFAULT_WAIT_TIMEOUT = 30
+
+# Scheduling presets (`generate --scheduling-profile`). Parameters which are
+# explicitly provided take precedence over the preset's. Real-time CPU
+# policies (fifo, rr) are left out as they can starve the rest of the host.
+SCHEDULING_PROFILES = {
+    'latency': dict(
+        nice=-10,
+        io_scheduling_class='best-effort',
+        io_scheduling_priority=0,
+        oom_score_adjust=-500),
+    'batch': dict(
+        cpu_scheduling_policy='batch',
+        nice=10,
+        io_scheduling_class='best-effort',
+        io_scheduling_priority=7),
+    'background': dict(
+        cpu_scheduling_policy='idle',
+        nice=19,
+        io_scheduling_class='idle',
+        oom_score_adjust=500),
+}
+
+# Seconds each attempt of a readiness probe (e.g. connecting to a port)
+# may take before it's considered failed.
+PROBE_ATTEMPT_TIMEOUT = 2
+
+# Seconds between polling the state of services when watching them.
+DEFAULT_WATCH_INTERVAL = 0.5
+
+# Number of operations `AsyncServ` performs concurrently.
+DEFAULT_ASYNC_CONCURRENCY = 32
+
+# Directory in which Serv caches data. Defaults to `~/.cache/serv`.
+CACHE_DIR_ENV_VAR = 'SERV_CACHE_DIR'
+
+# The detected init system is cached under the cache dir and is invalidated
+# when any of these files change.
+INIT_SYSTEM_CACHE_FILE = 'init-system.json'
+INIT_SYSTEM_CACHE_KEY_PATHS = ('/etc/os-release', '/proc/1/exe')
+# If set, the detected init system will not be cached.
+DISABLE_INIT_SYSTEM_CACHE_ENV_VAR = 'SERV_DISABLE_INIT_SYSTEM_CACHE'
+
+# If set, the time spent in each phase of an operation is recorded.
+PROFILE_ENV_VAR = 'SERV_PROFILE'
+
+# If set, rendered templates are cached under this directory in the cache
+# dir. Once it contains more than `RENDER_CACHE_MAX_ENTRIES` files, the
+# least recently used ones are evicted.
+RENDER_CACHE_DIR = 'render'
+RENDER_CACHE_MAX_ENTRIES = 10000
+ENABLE_RENDER_CACHE_ENV_VAR = 'SERV_RENDER_CACHE'
+
 TEMPLATES = {
     'systemd': {
         '.service': '/lib/systemd/system',
@@ -1,17 +1,158 @@
 import os
+import re
 import json
+import time
 import shutil
-import pkgutil
-from distutils.spawn import find_executable
-
-import jinja2
+import threading
 
+from .. import cache
 from .. import utils
+from .. import constants
+from .. import profiling
 from ..exceptions import ServError
 
 
+_TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+
+# The fields of each service's status (see `Base.status`).
+STATUS_FIELDS = (
+    'name',
+    'description',
+    'load',
+    'active',
+    'sub',
+    'pid',
+    'memory',
+    'cpu_time',
+    'uptime',
+    'restarts',
+)
+
+# The fields of a service's status which make up its state. An event is
+# emitted when any of them changes (see `Base.watch`).
+STATE_FIELDS = ('load', 'active', 'sub', 'pid')
+
+# The fields of each service's resource usage (see `Base.stats`).
+STATS_FIELDS = (
+    'name',
+    'memory',
+    'cpu_time',
+    'cpu_user_time',
+    'cpu_system_time',
+    'tasks',
+    'io_read_bytes',
+    'io_write_bytes',
+)
+
+# cgroup based resource controls. Implementations list the ones they can
+# apply (along with the `SCHEDULING_PARAMS`) in
+# `supported_resource_controls` and warn about any other.
+RESOURCE_CONTROL_PARAMS = (
+    'cpu_quota',
+    'cpu_weight',
+    'memory_high',
+    'memory_max',
+    'tasks_max',
+    'io_weight',
+    'cpu_affinity',
+    'numa_policy',
+    'numa_mask',
+)
+NUMA_POLICIES = ('default', 'preferred', 'bind', 'interleave', 'local')
+SCHEDULING_PARAMS = (
+    'cpu_scheduling_policy',
+    'cpu_scheduling_priority',
+    'io_scheduling_class',
+    'io_scheduling_priority',
+    'oom_score_adjust',
+)
+CPU_SCHEDULING_POLICIES = ('other', 'batch', 'idle', 'fifo', 'rr')
+IO_SCHEDULING_CLASSES = ('realtime', 'best-effort', 'idle')
+# e.g. `512M` or `infinity`.
+_SIZE_PATTERN = re.compile(r'^([1-9]\d*[KMGT]?|infinity)$')
+# e.g. `0-3,6` or `0 1 2`.
+_CPU_LIST_PATTERN = re.compile(r'^\d+(-\d+)?([ ,]\d+(-\d+)?)*$')
+
+_template_environment = None
+
+
+def get_template_environment():
+    """Return the Jinja2 environment used to render all service templates.
+
+    The environment is created once per process and loads templates from
+    `serv/init/templates`. Compiled templates are cached in memory so that
+    rendering the same template for many services parses and compiles it
+    only once.
+
+    If the `SERV_TEMPLATE_CACHE_DIR` environment variable is set, compiled
+    templates are also persisted as bytecode in that directory so that
+    subsequent invocations can skip compilation altogether.
+    """
+    global _template_environment
+    if _template_environment is None:
+        # Jinja2 is only imported when rendering as it is relatively slow
+        # to import and most commands don't render anything.
+        import jinja2
+
+        bytecode_cache = None
+        cache_dir = os.environ.get(constants.TEMPLATE_CACHE_DIR_ENV_VAR)
+        if cache_dir:
+            utils.makedirs(cache_dir)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+        _template_environment = jinja2.Environment(
+            loader=jinja2.PackageLoader('serv.init', 'templates'),
+            bytecode_cache=bytecode_cache,
+            # Templates are shipped with the package and never change
+            # during the lifetime of the process.
+            auto_reload=False)
+    return _template_environment
+
+
+class Batch(object):
+    """Init system operations deferred while batching (see `Serv.batch`).
+
+    Implementations `defer` operations (e.g. `enable`) for their service
+    instead of performing them and perform all deferred operations at
+    once in `commit_batch`.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def defer(self, operation, *items):
+        """Defer `operation` for `items` (e.g. service names or files).
+
+        An operation may also be deferred without any items (e.g. reloading
+        the init system's configuration).
+        """
+        with self._lock:
+            self._operations.setdefault(operation, []).extend(items)
+
+    def get(self, operation):
+        """Return the items for which `operation` was deferred.
+        """
+        return list(self._operations.get(operation, []))
+
+    def __contains__(self, operation):
+        return operation in self._operations
+
+    def __bool__(self):
+        return bool(self._operations)
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return '{0}({1})'.format(self.__class__.__name__, self._operations)
+
+
 class Base(object):
-    def __init__(self, logger=None, **params):
+    # Non-zero return codes of an action's command which don't indicate
+    # a failure (see `get_command`).
+    tolerated_return_codes = {}
+    # The `RESOURCE_CONTROL_PARAMS` which the implementation applies.
+    supported_resource_controls = ()
+
+    def __init__(self, logger=None, batch=None, **params):
         """Provide defaults for all other subclasses.
 
         This should always be supered.
@@ -23,9 +164,18 @@ class Base(object):
         `self.init_system` is the name of the init system (e.g. systemd).
         `self.cmd` is the command to run.
         `self.name` is the name of the service.
+
+        `self.batch` is the `Batch` into which operations should be
+        deferred, or None if they should be performed immediately.
+
+        `self.file_states` maps the destination of each deployed file to
+        whether it was `created`, `updated` or is `unchanged`
+        (see `deploy_service_file`).
         """
         self.logger = logger
+        self.batch = batch
         self.params = params
+        self.file_states = {}
 
         self.init_system = params.get('init_sys')
         self.cmd = params.get('cmd')
@@ -42,12 +192,37 @@ class Base(object):
         params['chroot'] = params.get('chroot', '/')
         params['user'] = params.get('user', 'root')
         params['group'] = params.get('group', 'root')
+        profile = params.get('scheduling_profile')
+        if profile:
+            if profile not in constants.SCHEDULING_PROFILES:
+                raise ServError(
+                    'Scheduling profile must be one of {0}. You provided: '
+                    '{1}'.format(', '.join(sorted(
+                        constants.SCHEDULING_PROFILES)), profile))
+            for param, value in \
+                    constants.SCHEDULING_PROFILES[profile].items():
+                if params.get(param) is None:
+                    params[param] = value
+        params['requires'] = utils.to_list(params.get('requires'))
+        # Services are always started after the services they require.
+        params['after'] = params['requires'] + [
+            service for service in utils.to_list(params.get('after'))
+            if service not in params['requires']]
 
     def _validate_service_params(self):
         niceness = self.params.get('nice')
         if niceness is not None and (niceness < -20 or niceness > 19):
             raise ServError('`niceness` level must be between -20 and 19')
 
+        if self.params.get('probe'):
+            from .. import probes
+
+            probes.parse(self.params['probe'], self.name)
+
+        if self.name and self.name in self.params['after']:
+            raise ServError('Service {0} cannot depend on itself'.format(
+                self.name))
+
         limit_params = [
             'limit_coredump',
             'limit_cputime',
@@ -75,6 +250,83 @@ class Base(object):
                 if value < 1:
                     _raise_limit_error(limit_type, limit)
 
+        self._validate_resource_control_params()
+
+    def _validate_resource_control_params(self):
+        """Validate the cgroup based resource controls and the scheduling
+        params and normalize them to the format systemd accepts.
+        """
+        params = self.params
+
+        def validate(param, is_valid, description):
+            value = params.get(param)
+            if value is not None and not is_valid(str(value)):
+                raise ServError('`{0}` must be {1}. You provided: {2}'.format(
+                    param, description, value))
+
+        validate('cpu_quota', re.compile(r'^[1-9]\d*%?$').match,
+                 'a percentage greater than 0 (e.g. 50%)')
+        for param in ('cpu_weight', 'io_weight'):
+            validate(param, lambda v: v.isdigit() and 1 <= int(v) <= 10000,
+                     'an integer between 1 and 10000')
+        for param in ('memory_high', 'memory_max'):
+            validate(param, _SIZE_PATTERN.match,
+                     'a size in bytes, optionally suffixed with K, M, G or T, '
+                     'or infinity')
+        validate('tasks_max', re.compile(r'^([1-9]\d*|infinity)$').match,
+                 'an integer greater than 0 or infinity')
+        for param in ('cpu_affinity', 'numa_mask'):
+            validate(param, _CPU_LIST_PATTERN.match,
+                     'a list of CPUs or NUMA nodes (e.g. 0-3,6)')
+            if params.get(param) is not None:
+                params[param] = str(params[param]).replace(' ', ',')
+        validate('numa_policy', lambda v: v in NUMA_POLICIES,
+                 'one of {0}'.format(', '.join(NUMA_POLICIES)))
+        if params.get('numa_mask') is not None and \
+                params.get('numa_policy') in (None, 'default', 'local'):
+            raise ServError('`numa_mask` requires a `numa_policy` of '
+                            'preferred, bind or interleave')
+        if params.get('cpu_quota') is not None:
+            params['cpu_quota'] = str(params['cpu_quota']).rstrip('%') + '%'
+
+        def is_int_between(minimum, maximum):
+            return lambda v: re.match(r'^-?\d+$', v) and \
+                minimum <= int(v) <= maximum
+
+        validate('cpu_scheduling_policy',
+                 lambda v: v in CPU_SCHEDULING_POLICIES,
+                 'one of {0}'.format(', '.join(CPU_SCHEDULING_POLICIES)))
+        validate('cpu_scheduling_priority', is_int_between(1, 99),
+                 'an integer between 1 and 99')
+        # Only the real-time policies have a priority and they require one.
+        realtime = params.get('cpu_scheduling_policy') in ('fifo', 'rr')
+        if params.get('cpu_scheduling_priority') is not None and not realtime:
+            raise ServError('`cpu_scheduling_priority` requires a '
+                            '`cpu_scheduling_policy` of fifo or rr')
+        if realtime and params.get('cpu_scheduling_priority') is None:
+            raise ServError('A `cpu_scheduling_policy` of {0} requires a '
+                            '`cpu_scheduling_priority`'.format(
+                                params['cpu_scheduling_policy']))
+        validate('io_scheduling_class', lambda v: v in IO_SCHEDULING_CLASSES,
+                 'one of {0}'.format(', '.join(IO_SCHEDULING_CLASSES)))
+        validate('io_scheduling_priority', is_int_between(0, 7),
+                 'an integer between 0 and 7')
+        if params.get('io_scheduling_priority') is not None and \
+                params.get('io_scheduling_class') == 'idle':
+            raise ServError('`io_scheduling_priority` cannot be used with '
+                            'the idle `io_scheduling_class`')
+        validate('oom_score_adjust', is_int_between(-1000, 1000),
+                 'an integer between -1000 and 1000')
+
+    def _warn_about_unsupported_params(self):
+        unsupported = [p for p in RESOURCE_CONTROL_PARAMS + SCHEDULING_PARAMS
+                       if self.params.get(p) is not None and
+                       p not in self.supported_resource_controls]
+        if unsupported:
+            self.logger.warning(
+                '%s cannot apply %s. They will be ignored.',
+                self.init_system, ', '.join(unsupported))
+
     def generate(self, overwrite):
         """Generate service files.
 
@@ -101,9 +353,10 @@ class Base(object):
         the developer doesn't have to address this. It is provided by the API
         or by the CLI and propagated.
         """
+        self._warn_about_unsupported_params()
         self.files = []
         tmp = utils.get_tmp_dir(self.init_system, self.name)
-        self.templates = os.path.join(os.path.dirname(__file__), 'templates')
+        self.templates = _TEMPLATES_DIR
         self.template_prefix = self.init_system
         self.generate_into_prefix = os.path.join(tmp, self.name)
         self.overwrite = overwrite
@@ -117,7 +370,11 @@ class Base(object):
         When trying to install a service, if the executable for the command
         is not found, this will fail miserably.
         """
-        if not find_executable(self.cmd):
+        from distutils.spawn import find_executable
+
+        with profiling.timer('find_executable', self.cmd):
+            executable = find_executable(self.cmd)
+        if not executable:
             raise ServError('Executable {0} could not be found'.format(
                 self.cmd))
 
@@ -129,6 +386,26 @@ class Base(object):
         """Stop a service.
         """
 
+    def restart(self, timeout=constants.DEFAULT_WAIT_TIMEOUT):
+        """Restart a service.
+
+        Implementations should override this if the init system
+        natively supports restarting services. By default, the service
+        is stopped and is started once it has actually stopped (waiting up
+        to `timeout` seconds for that to happen).
+        """
+        self.stop()
+        self.wait_for_state(False, timeout)
+        self.start()
+
+    def reload(self):
+        """Reload a service's configuration without restarting it.
+
+        This is commonly implemented by sending SIGHUP to the service.
+        """
+        raise ServError('{0} does not support reloading services'.format(
+            self.init_system))
+
     def uninstall(self):
         """Uninstall a service.
 
@@ -136,15 +413,129 @@ class Base(object):
         """
         # raise NotImplementedError('Must be implemented by a subclass')
 
+    @classmethod
+    def commit_batch(cls, batch, logger):
+        """Perform all operations deferred in `batch` at once.
+
+        Implementations which defer operations while batching must
+        override this.
+        """
+
     def status(self, **kwargs):
         """Retrieve the status of a service `name` or all services
         for the current init system.
+
+        Implementations accept `name` and `names`, a list of service names
+        or glob patterns whose statuses should be retrieved.
         """
         self.services = dict(
             init_system=self.init_system,
             services=[]
         )
 
+    def status_iter(self, name='', names=None):
+        """Yield the status of each service (see `status`) as soon
+        as it's retrieved.
+
+        Implementations should override this if they can retrieve
+        statuses incrementally (e.g. while parsing the output of
+        the init system's command).
+        """
+        for service in self.status(name=name, names=names)['services']:
+            yield service
+
+    def scale(self, count, pin_cpus=False):
+        """Converge the number of running instances of the service
+        to `count`.
+
+        Implementations should override this if the init system supports
+        running multiple instances of a service (e.g. systemd's template
+        units).
+        """
+        raise ServError('{0} does not support scaling services'.format(
+            self.init_system))
+
+    def list_services(self, pattern):
+        """Return the sorted names of the existing services matching
+        `pattern` (a name or a glob pattern).
+        """
+        return sorted(status['name'] for status in self.status_iter(pattern)
+                      if status['load'] != 'not-found')
+
+    def watch(self,
+              name='',
+              names=None,
+              interval=constants.DEFAULT_WATCH_INTERVAL):
+        """Yield an event whenever the state of the `name` service,
+        of the `names` services (names or glob patterns) or of any service
+        changes. This never returns.
+
+        Each event is the service's status (see `status`) along with the
+        time of the event and the `previous` state of the service (see
+        `STATE_FIELDS`), which is None if the service didn't exist.
+
+        By default, the statuses are polled every `interval` seconds.
+        Implementations should override this if the init system can
+        notify about changes.
+        """
+        states = self._get_states(name, names)
+        while True:
+            time.sleep(interval)
+            current = self._get_states(name, names)
+            for service in sorted(set(states) | set(current)):
+                status = current.get(service) or self._create_status(
+                    name=service, load='not-found', active='inactive')
+                event = self._create_event(status, states.get(service))
+                if event:
+                    yield event
+            states = current
+
+    def _get_states(self, name, names):
+        return dict((status['name'], status)
+                    for status in self.status_iter(name, names))
+
+    @staticmethod
+    def _create_event(status, previous):
+        """Return the event of a service's state changing from its
+        `previous` status to `status` or None if it didn't change.
+        """
+        state = dict((field, status[field]) for field in STATE_FIELDS)
+        if previous is not None:
+            previous = dict(
+                (field, previous[field]) for field in STATE_FIELDS)
+            if previous == state:
+                return None
+        return dict(status, time=round(time.time(), 3), previous=previous)
+
+    def stats(self, name='', names=None):
+        """Return the resource usage (see `STATS_FIELDS`) of the `name`
+        service, the `names` services (names or glob patterns) or
+        all services.
+        """
+        raise ServError('{0} does not support retrieving stats'.format(
+            self.init_system))
+
+    @staticmethod
+    def _create_status(**fields):
+        """Return the status of a service containing all `STATUS_FIELDS`.
+
+        Fields which aren't provided (e.g. as the init system doesn't
+        report them) are None. `memory` is in bytes while `cpu_time` and
+        `uptime` are in seconds.
+        """
+        status = dict.fromkeys(STATUS_FIELDS)
+        status.update(fields)
+        return status
+
+    @staticmethod
+    def _create_stats(**fields):
+        """Return the resource usage of a service containing all
+        `STATS_FIELDS`, like `_create_status` does.
+        """
+        stats = dict.fromkeys(STATS_FIELDS)
+        stats.update(fields)
+        return stats
+
     def is_system_exists(self):
         """Return True if the init system exists on the current machine
         or False if it doesn't.
@@ -155,6 +546,39 @@ class Base(object):
         and False if it isn't.
         """
 
+    def is_running(self):
+        """Return True if the service is currently running (or is still
+        stopping) and False if it isn't (or is still starting).
+
+        This is used to wait for services to reach their desired state
+        and should therefore query the actual state of the service.
+        """
+        raise NotImplementedError('Must be implemented by a subclass')
+
+    def get_command(self, action):
+        """Return the command (a list of arguments) which performs `action`
+        (`start`, `stop`, `restart` or `reload`) on the service or None if
+        the action can't be performed by a single command.
+
+        This allows performing actions asynchronously (see `AsyncServ`).
+        Return codes of the command other than 0 and those listed for the
+        action in `self.tolerated_return_codes` are considered failures.
+        """
+        return None
+
+    def wait_for_state(self, running, timeout):
+        """Wait for the service to start (or stop, if `running` is False)
+        by polling its state with an exponential backoff.
+
+        Raise if the service didn't reach the state within `timeout` seconds.
+        """
+        state = 'start' if running else 'stop'
+        self.logger.debug('Waiting for service %s to %s...', self.name, state)
+        if not utils.wait_for(lambda: self.is_running() == running, timeout):
+            raise ServError(
+                'Service {0} did not {1} within {2} seconds'.format(
+                    self.name, state, timeout))
+
     def validate_platform(self):
         """Validate that the platform the user is trying to install the
         service on is valid.
@@ -169,7 +593,10 @@ class Base(object):
 
         This is used by the different init implementations to generate
         init scripts/configs and deploy them to the relevant directories.
-        Templates are looked up under init/templates/`template`.
+        Templates are looked up under init/templates/`template` and are
+        compiled only once per process (see `get_template_environment`).
+        Rendered templates are cached so that a template is only rendered
+        again if it or `params` changed (see `serv.cache`).
 
         If the `destination` directory doesn't exist, it will alert
         the user and exit. We don't want to be creating any system
@@ -179,24 +606,38 @@ class Base(object):
         out of the box. For instance, `/etc/sysconfig` doesn't necessarily
         exist even if systemd is used by default.
         """
-        # We cast the object to a string before passing it on as py3.x
-        # will fail on Jinja2 if there are ints/bytes (not strings) in the
-        # template which will not allow `env.from_string(template)` to
-        # take place.
-        templates = str(pkgutil.get_data(__name__, os.path.join(
-            'templates', template)))
-
         pretty_params = json.dumps(self.params, indent=4, sort_keys=True)
         self.logger.debug(
             'Rendering %s with params: %s...', template, pretty_params)
-        generated = jinja2.Environment().from_string(
-            templates).render(self.params)
+        generated = self._render(template)
         self.logger.debug('Writing generated file to %s...', destination)
         self._should_overwrite(destination)
-        with open(destination, 'w') as f:
-            f.write(generated)
+        with profiling.timer('write', destination):
+            with open(destination, 'w') as f:
+                f.write(generated)
         self.files.append(destination)
 
+    def _render(self, template):
+        use_cache = cache.is_enabled()
+        if use_cache:
+            with profiling.timer('render_cache', template):
+                key = cache.get_key(
+                    os.path.join(_TEMPLATES_DIR, template), self.params)
+                generated = cache.get(key)
+            if generated is not None:
+                self.logger.debug('Using cached rendering of %s', template)
+                return generated
+
+        with profiling.timer('render', template):
+            generated = get_template_environment().get_template(
+                template).render(self.params)
+        if use_cache:
+            try:
+                cache.put(key, generated)
+            except (IOError, OSError) as ex:
+                self.logger.debug('Failed to cache %s: %s', template, ex)
+        return generated
+
     def _should_overwrite(self, destination):
         # TODO: this should probably move to serv.py and check for overwriting
         # on service creation/installation.
@@ -212,14 +653,55 @@ class Base(object):
         if not os.path.isdir(dirname):
             if create_directory:
                 self.logger.debug('Creating directory %s...', dirname)
-                os.makedirs(dirname)
+                utils.makedirs(dirname)
             else:
                 raise ServError(
                     'Directory {0} does not exist and is required for {1}. '
                     'Terminating...'.format(dirname, init_system_file))
 
     def deploy_service_file(self, source, destination, create_directory=False):
-        self._should_overwrite(destination)
+        """Move the generated `source` file to `destination` and return
+        whether the file was `created`, `updated` or is `unchanged`.
+
+        If `destination` already has the same content as `source`, `source`
+        is discarded instead of being deployed, regardless of `overwrite`.
+        """
+        if os.path.isfile(destination):
+            with profiling.timer('hash', destination):
+                unchanged = utils.get_file_hash(source) == \
+                    utils.get_file_hash(destination)
+            if unchanged:
+                self.logger.debug('%s is unchanged', destination)
+                os.remove(source)
+                self.file_states[destination] = 'unchanged'
+                return 'unchanged'
+            self._should_overwrite(destination)
+            state = 'updated'
+        else:
+            state = 'created'
         self._handle_service_directory(destination, create_directory)
         self.logger.info('Deploying %s to %s...', source, destination)
-        shutil.move(source, destination)
+        with profiling.timer('deploy', destination):
+            shutil.move(source, destination)
+        self.file_states[destination] = state
+        return state
+
+    def is_unchanged(self):
+        """Return True if all of the service's files were deployed
+        and none of them changed.
+
+        Implementations use this, along with `is_configured`, to skip
+        reconfiguring the init system (e.g. `systemctl daemon-reload`)
+        when redeploying a service.
+        """
+        return bool(self.file_states) and all(
+            state == 'unchanged' for state in self.file_states.values())
+
+    def is_configured(self):
+        """Return True if the init system already applied the service's
+        deployed files (e.g. the service is enabled and loaded).
+
+        Unchanged files don't guarantee this as a previous deployment may
+        have failed after deploying them (e.g. while enabling the service).
+        """
+        return False
@@ -13,6 +13,8 @@ RUNNING_STATES = ['SERVICE_RUNNING', 'SERVICE_STOP_PENDING']
 
 
 class Nssm(Base):
+    supported_resource_controls = ('cpu_affinity',)
+
     def __init__(self, logger=None, **params):
         super(Nssm, self).__init__(logger=logger, **params)
 
@@ -40,6 +42,10 @@ class Nssm(Base):
 
         if not os.path.isfile(self.nssm_exe):
             self._deploy_nssm_binary()
+        if self.is_unchanged() and self.is_configured():
+            self.logger.info(
+                'Service %s is unchanged. Skipping installation.', self.name)
+            return
         utils.run(self.svc_file_dest)
 
     def start(self):
@@ -48,6 +54,15 @@ class Nssm(Base):
     def stop(self):
         utils.run('sc stop {0}'.format(self.name))
 
+    def restart(self, timeout=constants.DEFAULT_WAIT_TIMEOUT):
+        self.nssm('restart')
+
+    def get_command(self, action):
+        if action in ('start', 'stop'):
+            return ['sc', action, self.name]
+        elif action == 'restart':
+            return [self.nssm_exe, action, self.name]
+
     # TODO: this should be a decorator under base.py to allow
     # cleanup on failed creation.
     def uninstall(self):
@@ -56,15 +71,23 @@ class Nssm(Base):
         if os.path.isfile(self.svc_file_dest):
             os.remove(self.svc_file_dest)
 
-    def status(self, name):
+    def status(self, name='', names=None):
         super(Nssm, self).status(name=name)
 
-        _, result, _ = self.nssm('status')
-        # apparently nssm output is encoded in utf16.
-        # encode to ascii to be able to parse this
-        state = result.decode('utf16').encode('utf-8').rstrip()
-        self.services.update(
-            {'services': [dict(name=self.name, status=state)]})
+        services = []
+        for service in [n for n in [name] + list(names or []) if n] or \
+                [self.name]:
+            if utils.is_glob(service):
+                raise ServError(
+                    'nssm does not support retrieving the status of services '
+                    'by a pattern. You provided: {0}'.format(service))
+            _, result, _ = utils.run('{0} status {1}'.format(
+                self.nssm_exe, service))
+            # apparently nssm output is encoded in utf16.
+            # encode to ascii to be able to parse this
+            state = result.decode('utf16').encode('utf-8').rstrip()
+            services.append(dict(name=service, status=state))
+        self.services.update({'services': services})
         return self.services
 
     def is_system_exists(self):
@@ -80,6 +103,14 @@ class Nssm(Base):
             return False
         return True
 
+    def is_configured(self):
+        return self.is_service_exists()
+
+    def is_running(self):
+        _, result, _ = self.nssm('status')
+        # nssm output is encoded in utf16.
+        return result.decode('utf16').strip() in RUNNING_STATES
+
     def nssm(self, cmd):
         return utils.run('{0} {1} {2}'.format(self.nssm_exe, cmd, self.name))
 
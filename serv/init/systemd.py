@@ -1,16 +1,40 @@
 import os
+import re
+import json
+import time
+import fnmatch
 
 from .. import utils
 from .. import constants
+from .. import profiling
 from ..exceptions import ServError
 
-from .base import Base
+from .base import Base, RESOURCE_CONTROL_PARAMS, SCHEDULING_PARAMS
 
 if not utils.IS_WIN:
     import sh
 
 
+# Unit properties retrieved by `status`.
+STATUS_PROPERTIES = (
+    'Id',
+    'Description',
+    'LoadState',
+    'ActiveState',
+    'SubState',
+    'MainPID',
+    'MemoryCurrent',
+    'CPUUsageNSec',
+    'ActiveEnterTimestampMonotonic',
+    'NRestarts',
+)
+
+
 class SystemD(Base):
+    # systemctl returns 5 when stopping a unit which isn't loaded.
+    tolerated_return_codes = {'stop': (5,)}
+    supported_resource_controls = RESOURCE_CONTROL_PARAMS + SCHEDULING_PARAMS
+
     def __init__(self, logger=None, **params):
         """Set the default parameters.
 
@@ -23,8 +47,12 @@ class SystemD(Base):
         for all services under the init system.)
 
         `self.name` is set in `base.py`
+
+        Names ending with `@` (e.g. `worker@`) are template units whose
+        instances (e.g. `worker@1`) are managed using `scale`.
         """
         super(SystemD, self).__init__(logger=logger, **params)
+        self.is_template = bool(self.name) and self.name.endswith('@')
 
         if self.name:
             self.svc_file_dest = os.path.join(
@@ -66,7 +94,11 @@ class SystemD(Base):
         self.env_file_path = self.generate_into_prefix
 
         self.generate_file_from_template(svc_file_template, self.svc_file_path)
-        self.generate_file_from_template(env_file_template, self.env_file_path)
+        # The env vars of template units are set in the unit itself so
+        # that specifiers (e.g. `%i`) in them are expanded per instance.
+        if not self.is_template:
+            self.generate_file_from_template(
+                env_file_template, self.env_file_path)
         return self.files
 
     def install(self):
@@ -75,27 +107,71 @@ class SystemD(Base):
         This is where we deploy the service files to their relevant
         locations and perform any other required actions to configure
         the service and make it ready to be `start`ed.
+
+        If none of the service's files changed and the service is already
+        enabled and loaded, systemd is not reloaded.
         """
         super(SystemD, self).install()
 
         self.deploy_service_file(self.svc_file_path, self.svc_file_dest)
-        self.deploy_service_file(self.env_file_path, self.env_file_dest)
-        sh.systemctl.enable(self.name)
-        sh.systemctl('daemon-reload')
+        if not self.is_template:
+            self.deploy_service_file(self.env_file_path, self.env_file_dest)
+        if self.is_unchanged() and self.is_configured():
+            self.logger.info(
+                'Service %s is unchanged. Skipping enable and reload.',
+                self.name)
+            return
+        if self.is_template:
+            # Only instances of template units can be enabled (see `scale`).
+            if self.batch is not None:
+                self.batch.defer('daemon-reload')
+            else:
+                _systemctl('daemon-reload')
+        elif self.batch is not None:
+            self.batch.defer('enable', self.name)
+            self.batch.defer('daemon-reload')
+        else:
+            _systemctl('enable', self.name)
+            _systemctl('daemon-reload')
 
     def start(self):
         """Start the service.
+
+        When batching, the service is started only after systemd
+        is reloaded so that its most recent unit file is used.
         """
-        sh.systemctl.start(self.name)
+        if self.is_template:
+            raise ServError(
+                '{0} is a template unit. Use `scale` to start instances '
+                'of it'.format(self.name))
+        if self.batch is not None:
+            self.batch.defer('start', self.name)
+        else:
+            _systemctl('start', self.name)
 
     def stop(self):
-        """Stop the service.
+        """Stop the service (or all instances of a template unit).
         """
         try:
-            sh.systemctl.stop(self.name)
+            _systemctl('stop', self.name + '*' if self.is_template
+                       else self.name)
         except sh.ErrorReturnCode_5:
             self.logger.debug('Service not running.')
 
+    def restart(self, timeout=constants.DEFAULT_WAIT_TIMEOUT):
+        """Restart the service.
+        """
+        _systemctl('restart', self.name)
+
+    def reload(self):
+        """Reload the service using its `ExecReload` command.
+        """
+        _systemctl('reload', self.name)
+
+    def get_command(self, action):
+        if action in ('start', 'stop', 'restart', 'reload'):
+            return ['systemctl', action, self.name]
+
     # TODO: this should be a decorator under base.py to allow
     # cleanup on failed creation.
     def uninstall(self):
@@ -105,45 +181,286 @@ class SystemD(Base):
         remove the service. Files, links, whatever else should be removed.
         This method should also run when implementing cleanup in case of
         failures. As such, idempotence should be considered.
+
+        When batching, the files are removed only after the service
+        is disabled as systemd can't disable a unit without its file.
+
+        All instances of template units are stopped and disabled first.
+        """
+        if self.is_template:
+            self.scale(0)
+            _remove_files([self.svc_file_dest])
+            if self.batch is not None:
+                self.batch.defer('daemon-reload')
+            else:
+                _systemctl('daemon-reload')
+            return
+
+        files = [self.svc_file_dest, self.env_file_dest]
+        if self.batch is not None:
+            self.batch.defer('disable', self.name)
+            self.batch.defer('remove', *files)
+            self.batch.defer('daemon-reload')
+            return
+
+        _systemctl('disable', self.name)
+        _systemctl('daemon-reload')
+        _remove_files(files)
+
+    @classmethod
+    def commit_batch(cls, batch, logger):
+        """Disable, enable, reload and start all services in `batch`
+        using a single `systemctl` call for each operation.
         """
-        sh.systemctl.disable(self.name)
-        sh.systemctl('daemon-reload')
-        if os.path.isfile(self.svc_file_dest):
-            os.remove(self.svc_file_dest)
-        if os.path.isfile(self.env_file_dest):
-            os.remove(self.env_file_dest)
+        if batch.get('disable'):
+            logger.info('Disabling services: %s...', batch.get('disable'))
+            _systemctl('disable', *batch.get('disable'))
+        _remove_files(batch.get('remove'))
+        if batch.get('enable'):
+            logger.info('Enabling services: %s...', batch.get('enable'))
+            _systemctl('enable', *batch.get('enable'))
+        if 'daemon-reload' in batch:
+            logger.debug('Reloading systemd...')
+            _systemctl('daemon-reload')
+        if batch.get('start'):
+            logger.info('Starting services: %s...', batch.get('start'))
+            _systemctl('start', *batch.get('start'))
+
+    def scale(self, count, pin_cpus=False):
+        """Converge the number of running instances of this template unit
+        (e.g. `worker@`) to `count` by enabling and starting instances
+        `1..count` and stopping and disabling any loaded instance above
+        `count`, whether it's running or not.
+
+        If `pin_cpus` is True, instance `i` is pinned to CPU `i - 1`
+        (modulo the number of CPUs) using a `CPUAffinity=` drop-in.
+        Otherwise, any such drop-in is removed. As systemd only applies
+        a changed affinity when an instance starts, already running
+        instances must be restarted for it to take effect.
+
+        Return the names of the `instances` which should be running
+        and those which were `started` and `stopped`.
+        """
+        import multiprocessing
+
+        # Instances above `count` are stopped and disabled even if they
+        # aren't running (e.g. failed) so that they don't start on boot.
+        existing = set()
+        running = set()
+        for status in self.status_iter(self.name + '*'):
+            instance = status['name'][len(self.name):-len('.service')]
+            if not instance.isdigit() or status['load'] == 'not-found':
+                continue
+            existing.add(int(instance))
+            if status['active'] in ('active', 'activating', 'reloading'):
+                running.add(int(instance))
+        target = set(range(1, count + 1))
+
+        def get_units(instances):
+            return ['{0}{1}'.format(self.name, i) for i in sorted(instances)]
+
+        cpus = multiprocessing.cpu_count()
+        changed = []
+        for instance in target | existing:
+            cpu = (instance - 1) % cpus \
+                if pin_cpus and instance in target else None
+            unit = '{0}{1}'.format(self.name, instance)
+            if _set_cpu_affinity(unit, cpu):
+                changed.append(unit)
+        if changed:
+            _systemctl('daemon-reload')
+            restart = sorted(set(changed) & set(get_units(target & running)))
+            if restart:
+                self.logger.warning(
+                    'The CPU affinity of running instances %s changed. '
+                    'Restart them to apply it.', ', '.join(restart))
+
+        to_stop = get_units(existing - target)
+        to_start = get_units(target - running)
+        if to_stop:
+            self.logger.info('Stopping instances: %s...', to_stop)
+            _systemctl('stop', *to_stop)
+            _systemctl('disable', *to_stop)
+        if to_start:
+            self.logger.info('Starting instances: %s...', to_start)
+            _systemctl('enable', *to_start)
+            _systemctl('start', *to_start)
+        return dict(
+            instances=get_units(target), started=to_start, stopped=to_stop)
 
-    def status(self, name=''):
+    def status(self, name='', names=None):
         """Return a list of the statuses of the `name` service, or
         if name is omitted, a list of the status of all services for this
         specific init system.
 
-        There should be a standardization around the status fields.
-        There currently isn't.
+        If `names` (service names or glob patterns) are provided,
+        the statuses of all of matching services are returned.
+        The names are passed on to `systemctl` so that only the
+        requested services are queried.
+
+        The properties of all services are retrieved using a single
+        `systemctl show` call. Note that glob patterns only match
+        units which are loaded.
 
         `self.services` is set in `base.py`
         """
         super(SystemD, self).status(name=name)
-
-        svc_list = sh.systemctl('--no-legend', '--no-pager', t='service')
-        svcs_info = [self._parse_service_info(svc) for svc in svc_list]
-        if name:
-            names = (name, name + '.service')
-            # return list of one item for specific service
-            svcs_info = [s for s in svcs_info if s['name'] in names]
-        self.services['services'] = svcs_info
+        self.services['services'] = list(self.status_iter(name, names))
         return self.services
 
-    @staticmethod
-    def _parse_service_info(svc):
-        svc_info = svc.split()
-        return dict(
-            name=svc_info[0],
-            load=svc_info[1],
-            active=svc_info[2],
-            sub=svc_info[3],
-            description=svc_info[4]
-        )
+    def status_iter(self, name='', names=None):
+        """Yield the status of each service while `systemctl show`'s
+        output is consumed.
+        """
+        patterns = [_get_unit_name(n) for n in [name] + list(names or []) if n]
+        output = _systemctl(
+            'show',
+            '--property=' + ','.join(STATUS_PROPERTIES),
+            *(patterns or ['*.service']),
+            _iter=True)
+        for status in self._parse_show_output(output):
+            yield status
+
+    def list_services(self, pattern):
+        """Return the sorted names of the services matching `pattern`
+        without their `.service` suffix (see `Base.list_services`).
+        """
+        return [name[:-len('.service')] if name.endswith('.service') else name
+                for name in super(SystemD, self).list_services(pattern)]
+
+    @classmethod
+    def _parse_show_output(cls, lines):
+        """Yield the status of each unit in the output of `systemctl show`
+        in which the properties of each unit are separated by an empty line.
+        """
+        properties = {}
+        for line in lines:
+            line = line.rstrip('\n')
+            if line:
+                key, _, value = line.partition('=')
+                properties[key] = value
+            elif properties:
+                yield cls._get_unit_status(properties)
+                properties = {}
+        if properties:
+            yield cls._get_unit_status(properties)
+
+    @classmethod
+    def _get_unit_status(cls, properties):
+        active = properties.get('ActiveState')
+        cpu_time = _parse_int(properties.get('CPUUsageNSec'))
+        active_since = _parse_int(
+            properties.get('ActiveEnterTimestampMonotonic'))
+        uptime = None
+        # `ActiveEnterTimestampMonotonic` is relative to the same clock as
+        # `time.monotonic` which is not available on Python 2.
+        if active_since and active in ('active', 'reloading') and \
+                hasattr(time, 'monotonic'):
+            uptime = round(time.monotonic() - active_since / 1e6, 3)
+        return cls._create_status(
+            name=properties.get('Id'),
+            description=properties.get('Description'),
+            load=properties.get('LoadState'),
+            active=active,
+            sub=properties.get('SubState'),
+            pid=_parse_int(properties.get('MainPID')) or None,
+            memory=_parse_int(properties.get('MemoryCurrent')),
+            cpu_time=None if cpu_time is None else cpu_time / 1e9,
+            uptime=uptime,
+            restarts=_parse_int(properties.get('NRestarts')))
+
+    def watch(self,
+              name='',
+              names=None,
+              interval=constants.DEFAULT_WATCH_INTERVAL):
+        """Yield an event whenever the state of a service changes
+        (see `Base.watch`).
+
+        Rather than polling, systemd's journal is followed and the status
+        of a service is only retrieved when systemd logs a message about
+        it (e.g. once it's started, stopped or its process exited).
+        Reading the system journal usually requires root privileges.
+        If `journalctl` isn't available or the system journal can't be
+        read, statuses are polled.
+        """
+        patterns = [_get_unit_name(n) for n in [name] + list(names or [])
+                    if n] or ['*.service']
+        matches = re.compile('|'.join(
+            fnmatch.translate(p) for p in patterns)).match
+        if not self._is_journal_readable():
+            for event in super(SystemD, self).watch(name, names, interval):
+                yield event
+            return
+
+        # Only follow systemd's own messages which include messages
+        # about units changing their state.
+        journal = _journalctl(
+            '--follow', '--output=json', '--lines=0', '_PID=1', _iter=True)
+        try:
+            states = self._get_states(name, names)
+            for line in journal:
+                try:
+                    unit = json.loads(line).get('UNIT')
+                except ValueError:
+                    continue
+                if not unit or not matches(unit):
+                    continue
+                for status in self.status_iter(unit):
+                    event = self._create_event(status, states.get(unit))
+                    states[unit] = status
+                    if event:
+                        yield event
+        except sh.ErrorReturnCode as ex:
+            raise ServError('Failed to watch services: {0}'.format(
+                ex.stderr.decode('utf-8', 'replace').strip()))
+        finally:
+            try:
+                journal.terminate()
+            except OSError:
+                pass
+
+    def _is_journal_readable(self):
+        """Return True if systemd's own messages can be read from the
+        journal.
+
+        Users who can't read the system journal (e.g. aren't root) only
+        see their own messages so following it would never yield events.
+        """
+        try:
+            output = _journalctl(
+                '--lines=1', '--output=json', '--quiet', '_PID=1')
+        except sh.CommandNotFound:
+            self.logger.debug('journalctl not found. Polling instead...')
+            return False
+        except sh.ErrorReturnCode:
+            output = ''
+        if not str(output).strip():
+            self.logger.warning(
+                'Cannot read systemd\'s messages from the journal. '
+                'Polling instead...')
+            return False
+        return True
+
+    def stats(self, name='', names=None):
+        """Return the resource usage of the `name` service, of the `names`
+        services (names or glob patterns) or of all running services.
+
+        The usage is read directly from the services' cgroups (under
+        `/sys/fs/cgroup`) without running any commands. Both cgroup v2
+        (the unified hierarchy) and v1 are supported. Services which
+        aren't running have no cgroup so their usage is None.
+        """
+        cgroup_v2 = os.path.isfile(
+            os.path.join(constants.CGROUP_PATH, 'cgroup.controllers'))
+        services = []
+        for unit in _get_cgroup_units(
+                [n for n in [name] + list(names or []) if n], cgroup_v2):
+            if cgroup_v2:
+                stats = _read_cgroup_v2_stats(unit)
+            else:
+                stats = _read_cgroup_v1_stats(unit)
+            services.append(self._create_stats(name=unit, **stats))
+        return dict(init_system=self.init_system, services=services)
 
     @staticmethod
     def is_system_exists():
@@ -154,6 +471,32 @@ class SystemD(Base):
     def is_service_exists(self):
         return os.path.isfile(self.svc_file_dest)
 
+    def is_running(self):
+        """Return True if the service's `ActiveState` is one in which
+        its processes may still be running.
+        """
+        output = _systemctl('show', self.name, property='ActiveState')
+        _, _, state = str(output).strip().partition('=')
+        return state in ('active', 'reloading', 'deactivating')
+
+    def is_configured(self):
+        """Return True if the unit is enabled and loaded from its current
+        unit file.
+
+        Template units can't be enabled so they're never considered
+        configured and systemd is always reloaded when deploying them.
+        """
+        if self.is_template:
+            return False
+        output = _systemctl(
+            'show', self.name,
+            property='LoadState,UnitFileState,NeedDaemonReload')
+        properties = dict(
+            line.partition('=')[::2] for line in str(output).splitlines())
+        return properties.get('LoadState') == 'loaded' and \
+            properties.get('UnitFileState') == 'enabled' and \
+            properties.get('NeedDaemonReload') == 'no'
+
     def _validate_init_system_specific_params(self):
         if not self.cmd.startswith('/'):
             raise ServError(
@@ -166,6 +509,171 @@ class SystemD(Base):
                 'Cannot install SystemD service on non-Linux systems.')
 
 
+def _systemctl(*args, **kwargs):
+    with profiling.timer('systemctl', ' '.join(args)):
+        return sh.systemctl(*args, **kwargs)
+
+
+def _parse_int(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        # e.g. `[not set]`
+        return None
+    # Older versions of systemd report unset values as the maximum uint64.
+    return None if value == 2 ** 64 - 1 else value
+
+
+def _get_cgroup_units(patterns, cgroup_v2):
+    """Return the units matching `patterns` (all units if there
+    are none). Glob patterns only match units which have a cgroup.
+    """
+    units = []
+    listed = None
+    for pattern in patterns or ['*']:
+        unit = _get_unit_name(pattern)
+        if not utils.is_glob(unit):
+            units.append(unit)
+            continue
+        if listed is None:
+            # On cgroup v1, the `systemd` hierarchy contains all units.
+            slice_path = os.path.join(
+                constants.CGROUP_PATH,
+                '' if cgroup_v2 else 'systemd',
+                'system.slice')
+            try:
+                listed = sorted(n for n in os.listdir(slice_path)
+                                if n.endswith('.service'))
+            except OSError:
+                listed = []
+        units.extend(fnmatch.filter(listed, unit))
+    unique = []
+    for unit in units:
+        if unit not in unique:
+            unique.append(unit)
+    return unique
+
+
+def _read_cgroup_file(*path):
+    try:
+        with open(os.path.join(constants.CGROUP_PATH, *path)) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _read_cgroup_v2_stats(unit):
+    def read(filename):
+        return _read_cgroup_file('system.slice', unit, filename)
+
+    stats = dict(
+        memory=_parse_int(read('memory.current')),
+        tasks=_parse_int(read('pids.current')))
+    cpu_stat = _parse_keyed_values(read('cpu.stat'))
+    for field, key in (('cpu_time', 'usage_usec'),
+                       ('cpu_user_time', 'user_usec'),
+                       ('cpu_system_time', 'system_usec')):
+        if key in cpu_stat:
+            stats[field] = cpu_stat[key] / 1e6
+    io_stat = read('io.stat')
+    if io_stat is not None:
+        # Each line contains the stats of a device (e.g. `8:0 rbytes=1024
+        # wbytes=2048 rios=1 wios=2 dbytes=0 dios=0`).
+        stats.update(io_read_bytes=0, io_write_bytes=0)
+        for line in io_stat.splitlines():
+            values = dict(v.split('=', 1) for v in line.split()[1:])
+            stats['io_read_bytes'] += int(values.get('rbytes', 0))
+            stats['io_write_bytes'] += int(values.get('wbytes', 0))
+    return stats
+
+
+def _read_cgroup_v1_stats(unit):
+    def read(controller, filename):
+        return _read_cgroup_file(controller, 'system.slice', unit, filename)
+
+    stats = dict(
+        memory=_parse_int(read('memory', 'memory.usage_in_bytes')),
+        tasks=_parse_int(read('pids', 'pids.current')))
+    cpu_usage = _parse_int(read('cpuacct', 'cpuacct.usage'))
+    if cpu_usage is not None:
+        stats['cpu_time'] = cpu_usage / 1e9
+    # The user and system times are in clock ticks.
+    cpu_stat = _parse_keyed_values(read('cpuacct', 'cpuacct.stat'))
+    if cpu_stat:
+        clock_ticks = os.sysconf('SC_CLK_TCK')
+        stats['cpu_user_time'] = cpu_stat.get('user', 0) / float(clock_ticks)
+        stats['cpu_system_time'] = \
+            cpu_stat.get('system', 0) / float(clock_ticks)
+    io_bytes = read('blkio', 'blkio.throttle.io_service_bytes')
+    if io_bytes is not None:
+        # Each line contains a device and an operation (e.g. `8:0 Read
+        # 1024`) except for the last line which is the total.
+        stats.update(io_read_bytes=0, io_write_bytes=0)
+        for line in io_bytes.splitlines():
+            fields = line.split()
+            if len(fields) == 3 and fields[1] in ('Read', 'Write'):
+                key = 'io_read_bytes' if fields[1] == 'Read' \
+                    else 'io_write_bytes'
+                stats[key] += int(fields[2])
+    return stats
+
+
+def _parse_keyed_values(content):
+    """Return a dict of the `key value` lines in `content`
+    (e.g. cgroup's `cpu.stat`).
+    """
+    values = {}
+    for line in (content or '').splitlines():
+        key, _, value = line.partition(' ')
+        value = _parse_int(value)
+        if value is not None:
+            values[key] = value
+    return values
+
+
+def _get_unit_name(name):
+    if name.endswith('.service'):
+        return name
+    return name + '.service'
+
+
+def _journalctl(*args, **kwargs):
+    with profiling.timer('journalctl', ' '.join(args)):
+        return sh.journalctl(*args, **kwargs)
+
+
+def _set_cpu_affinity(unit, cpu):
+    """Pin `unit` to `cpu` using a drop-in or, if `cpu` is None, remove
+    the drop-in. Return True if the drop-in changed.
+    """
+    drop_in_dir = os.path.join(
+        constants.SYSTEMD_DROP_IN_PATH, unit + '.service.d')
+    path = os.path.join(drop_in_dir, constants.SYSTEMD_CPU_AFFINITY_DROP_IN)
+    if cpu is None:
+        if not os.path.isfile(path):
+            return False
+        os.remove(path)
+        if not os.listdir(drop_in_dir):
+            os.rmdir(drop_in_dir)
+        return True
+
+    content = '[Service]\nCPUAffinity={0}\n'.format(cpu)
+    if os.path.isfile(path):
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    utils.makedirs(drop_in_dir)
+    with open(path, 'w') as f:
+        f.write(content)
+    return True
+
+
+def _remove_files(files):
+    for path in files:
+        if os.path.isfile(path):
+            os.remove(path)
+
+
 def is_system_exists():
     try:
         try:
@@ -1,17 +1,25 @@
 import os
+import errno
+import fnmatch
 import subprocess
 
 from .. import utils
 from .. import constants
+from .. import profiling
 from ..exceptions import ServError
 
-from .base import Base
+from .base import Base, RESOURCE_CONTROL_PARAMS, SCHEDULING_PARAMS
 
 if not utils.IS_WIN:
     import sh
 
 
 class SysV(Base):
+    # These are applied on a best-effort basis using taskset, numactl, chrt,
+    # ionice and libcgroup's tools, if they're installed (see the `sysv`
+    # template).
+    supported_resource_controls = RESOURCE_CONTROL_PARAMS + SCHEDULING_PARAMS
+
     def __init__(self, logger=None, **params):
         super(SysV, self).__init__(logger=logger, **params)
 
@@ -44,9 +52,7 @@ class SysV(Base):
 
     def start(self):
         try:
-            subprocess.check_call(
-                'service {0} start'.format(self.name),
-                shell=True, stdout=subprocess.PIPE)
+            _service(self.name, 'start')
         except sh.CommandNotFound:
             # TODO: cleanup generated files if not found.
             self.logger.warning(
@@ -61,9 +67,7 @@ class SysV(Base):
 
     def stop(self):
         try:
-            subprocess.check_call(
-                'service {0} stop'.format(self.name),
-                shell=True, stdout=subprocess.PIPE)
+            _service(self.name, 'stop')
         except sh.CommandNotFound:
             self.logger.warning(
                 'service command unavailable. Trying to run script directly.')
@@ -75,15 +79,105 @@ class SysV(Base):
         except:
             self.logger.info('Service already stopped.')
 
+    def restart(self, timeout=constants.DEFAULT_WAIT_TIMEOUT):
+        self._run_service_command('restart')
+
+    def reload(self):
+        """Send SIGHUP to the service.
+
+        See the `reload` case in the `sysv` template.
+        """
+        self._run_service_command('reload')
+
+    def get_command(self, action):
+        if action in ('start', 'stop', 'restart', 'reload'):
+            return ['service', self.name, action]
+
+    def _run_service_command(self, action):
+        try:
+            _service(self.name, action)
+        except subprocess.CalledProcessError as ex:
+            raise ServError('Failed to {0} service {1}: {2}'.format(
+                action, self.name, ex))
+
     def uninstall(self):
         if os.path.isfile(self.svc_file_dest):
             os.remove(self.svc_file_dest)
         if os.path.isfile(self.env_file_dest):
             os.remove(self.env_file_dest)
 
-    def status(self, name=''):
-        """WIP!"""
-        raise NotImplementedError()
+    def status(self, name='', names=None):
+        """Return the statuses of the `name` service, of the `names`
+        services (names or glob patterns) or of all services in
+        `/etc/init.d`.
+
+        See `status_iter` for how statuses are retrieved.
+        """
+        super(SysV, self).status(name=name)
+        self.services['services'] = list(self.status_iter(name, names))
+        return self.services
+
+    def status_iter(self, name='', names=None):
+        """Yield the status of each service without running any commands.
+
+        A service is running if the process in its pidfile
+        (`/var/run/<name>.pid`) is alive and is running the script's
+        `program`. Its memory (RSS), CPU time and uptime are read
+        from `/proc/<pid>/stat`.
+        """
+        patterns = [n for n in [name] + list(names or []) if n]
+        try:
+            scripts = sorted(os.listdir(constants.SYSV_SVC_PATH))
+        except OSError:
+            scripts = []
+        if patterns:
+            requested = [p for p in patterns if not utils.is_glob(p)]
+            scripts = [s for s in scripts if s in requested or any(
+                fnmatch.fnmatch(s, p) for p in patterns)]
+            for missing in sorted(set(requested) - set(scripts)):
+                yield self._create_status(
+                    name=missing, load='not-found', active='inactive',
+                    sub='dead')
+
+        clock_ticks, page_size, system_uptime = _get_proc_constants()
+        for script in scripts:
+            program, description = _read_script_info(
+                os.path.join(constants.SYSV_SVC_PATH, script))
+            status = self._create_status(
+                name=script,
+                description=description,
+                load='loaded',
+                active='inactive',
+                sub='dead')
+            pid = _read_pidfile(script)
+            if pid is None:
+                yield status
+                continue
+
+            process = _read_process_stat(pid)
+            if process is None:
+                # Without /proc (e.g. on BSD), only check that it's alive.
+                alive = _is_process_alive(pid)
+            else:
+                alive = process['state'] != 'Z' and \
+                    _is_process_running(pid, program)
+            if not alive:
+                # The pidfile exists but its process is gone or it was
+                # reused by another process.
+                status.update(active='failed')
+                yield status
+                continue
+
+            status.update(active='active', sub='running', pid=pid)
+            if process is not None and clock_ticks:
+                status.update(
+                    memory=process['rss'] * page_size,
+                    cpu_time=round(process['cpu_ticks'] / clock_ticks, 3))
+                if system_uptime is not None:
+                    status['uptime'] = round(
+                        system_uptime - process['start_ticks'] / clock_ticks,
+                        3)
+            yield status
 
     @staticmethod
     def is_system_exists():
@@ -92,6 +186,14 @@ class SysV(Base):
     def is_service_exists(self):
         return os.path.isfile(self.svc_file_dest)
 
+    def is_running(self):
+        """Return True if the process in the service's pidfile is alive.
+
+        The pidfile is written by the `sysv` template's `start` function.
+        """
+        pid = _read_pidfile(self.name)
+        return pid is not None and _is_process_alive(pid)
+
     def _set_init_system_specific_params(self):
         # TODO: figure out if to depracate these two.
         self.params.update({
@@ -127,6 +229,118 @@ class SysV(Base):
                 'Cannot install SysVinit service on non-Linux systems.')
 
 
+def _service(name, action):
+    with profiling.timer('service', '{0} {1}'.format(name, action)):
+        subprocess.check_call(
+            'service {0} {1}'.format(name, action),
+            shell=True, stdout=subprocess.PIPE)
+
+
+def _read_pidfile(name):
+    try:
+        with open(os.path.join(constants.SYSV_PID_PATH, name + '.pid')) as f:
+            return int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _read_script_info(path):
+    """Return the `program` a script runs and its description.
+
+    Either is None if the script doesn't specify it (e.g. if it wasn't
+    generated by Serv).
+    """
+    program = description = None
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('program='):
+                    program = line.split('=', 1)[1].strip()
+                elif line.startswith('# Description:'):
+                    description = line.split(':', 1)[1].strip()
+                if program and description:
+                    break
+    except (IOError, OSError, UnicodeDecodeError):
+        pass
+    return program, description
+
+
+def _get_proc_constants():
+    """Return the number of clock ticks per second, the size of a memory
+    page and the system's uptime in seconds, required to interpret
+    `/proc/<pid>/stat`.
+    """
+    try:
+        clock_ticks = os.sysconf('SC_CLK_TCK')
+        page_size = os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None, None, None
+    try:
+        with open(os.path.join(constants.PROC_PATH, 'uptime')) as f:
+            uptime = float(f.read().split()[0])
+    except (IOError, OSError, ValueError, IndexError):
+        uptime = None
+    return clock_ticks, page_size, uptime
+
+
+def _read_process_stat(pid):
+    """Return the state, CPU time (in clock ticks), start time
+    (in clock ticks since boot) and RSS (in pages) of the `pid` process
+    or None if it doesn't exist or /proc isn't available.
+    """
+    try:
+        with open(os.path.join(
+                constants.PROC_PATH, str(pid), 'stat')) as f:
+            stat = f.read()
+    except (IOError, OSError):
+        return None
+    # The process' name is enclosed in parentheses and may contain
+    # spaces. The fields after it start with the third field (state).
+    fields = stat.rpartition(')')[2].split()
+    try:
+        return dict(
+            state=fields[0],
+            cpu_ticks=int(fields[11]) + int(fields[12]),
+            start_ticks=int(fields[19]),
+            rss=int(fields[21]))
+    except (IndexError, ValueError):
+        return None
+
+
+def _is_process_running(pid, program):
+    """Return True if the `pid` process is running `program`.
+
+    This makes sure that a pid in a stale pidfile wasn't reused by
+    another process. If `program` is unknown, any process is accepted.
+    """
+    if not program:
+        return True
+    proc_path = os.path.join(constants.PROC_PATH, str(pid))
+    try:
+        with open(os.path.join(proc_path, 'cmdline'), 'rb') as f:
+            executable = f.read().split(b'\0')[0].decode('utf-8', 'replace')
+    except (IOError, OSError):
+        return False
+    if executable == program or \
+            os.path.basename(executable) == os.path.basename(program):
+        return True
+    try:
+        # e.g. if `program` is a symlink to the actual executable.
+        return os.path.realpath(os.readlink(os.path.join(
+            proc_path, 'exe'))) == os.path.realpath(program)
+    except OSError:
+        return False
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        # The process exists but belongs to a different user.
+        return ex.errno == errno.EPERM
+    return True
+
+
 def is_system_exists():
     # TODO: maybe a safer way would be to check if /etc/init.d is not empty.
     return os.path.isdir('/etc/init.d')
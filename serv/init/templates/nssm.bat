@@ -13,7 +13,19 @@ echo Setting service environment
 
 if %errorlevel% neq 0 exit /b %errorlevel%
 
-echo Configuring startup policy...
+{% if cpu_affinity %}echo Configuring CPU affinity...
+
+"{{ nssm_dir }}\nssm.exe" set "{{ name }}" AppAffinity {{ cpu_affinity }}
+
+if %errorlevel% neq 0 exit /b %errorlevel%
+
+{% endif %}{% if requires %}echo Configuring dependencies...
+
+"{{ nssm_dir }}\nssm.exe" set "{{ name }}" DependOnService{% for service in requires %} "{{ service }}"{% endfor %}
+
+if %errorlevel% neq 0 exit /b %errorlevel%
+
+{% endif %}echo Configuring startup policy...
 
 sc config {{ name }} start= {{ startup_policy }}
 
@@ -1,7 +1,10 @@
 import os
+import re
+import fnmatch
 
 from .. import utils
 from .. import constants
+from .. import profiling
 from ..exceptions import ServError
 
 from .base import Base
@@ -10,7 +13,25 @@ if not utils.IS_WIN:
     import sh
 
 
+# States in which a job's main process exists.
+RUNNING_STATES = ('spawned', 'post-start', 'running', 'pre-stop', 'stopping')
+
+# A job (or job instance) in the output of `initctl list`. For instance:
+#   ssh start/running, process 1234
+#   network-interface (eth0) start/running
+#   cron start/pre-start, (pre-start) process 1345
+JOB_STATUS = re.compile(
+    r'^(?P<name>\S+)(?: \((?P<instance>[^)]*)\))? '
+    r'(?P<goal>\w+)/(?P<state>[\w-]+)'
+    r'(?:, (?:\([\w-]+\) )?process (?P<pid>\d+))?')
+
+
 class Upstart(Base):
+    # Upstart returns 1 when starting a job which is already running
+    # and when stopping one which isn't.
+    tolerated_return_codes = {'start': (1,), 'stop': (1,)}
+    supported_resource_controls = ('oom_score_adjust',)
+
     def __init__(self, logger=None, **params):
         super(Upstart, self).__init__(logger=logger, **params)
 
@@ -34,26 +55,134 @@ class Upstart(Base):
         super(Upstart, self).install()
 
         self.deploy_service_file(self.svc_file_path, self.svc_file_dest)
+        if self.is_unchanged() and self.is_configured():
+            self.logger.info(
+                'Service %s is unchanged. Skipping reload.', self.name)
+            return
+        self._reload_configuration()
 
     def start(self):
-        """Start the service"""
-        try:
-            sh.start(self.name)
-        except:
-            self.logger.info('Service already started.')
+        """Start the service.
+
+        When batching, the service is started only after Upstart's
+        configuration is reloaded so that its job is known.
+        """
+        if self.batch is not None:
+            self.batch.defer('start', self.name)
+            return
+        _start(self.name, self.logger)
 
     def stop(self):
         try:
-            sh.stop(self.name)
+            _run('stop', self.name)
         except:
             self.logger.info('Service already stopped.')
 
+    def restart(self, timeout=constants.DEFAULT_WAIT_TIMEOUT):
+        """Restart the service.
+
+        Upstart refuses to restart jobs which aren't running, in which case
+        the service is simply started.
+        """
+        try:
+            _run('restart', self.name)
+        except sh.ErrorReturnCode:
+            self.logger.debug('Service not running.')
+            self.start()
+
+    def reload(self):
+        """Send SIGHUP to the service.
+        """
+        _run('reload', self.name)
+
+    def get_command(self, action):
+        # Restarting requires a fallback to `start` (see `restart`).
+        if action in ('start', 'stop', 'reload'):
+            return [action, self.name]
+
     def uninstall(self):
         if os.path.isfile(self.svc_file_dest):
             os.remove(self.svc_file_dest)
+        self._reload_configuration()
+
+    def _reload_configuration(self):
+        if self.batch is not None:
+            self.batch.defer('reload-configuration')
+        else:
+            _run('initctl', 'reload-configuration')
+
+    @classmethod
+    def commit_batch(cls, batch, logger):
+        """Reload Upstart's configuration once and then start all
+        services in `batch`.
+        """
+        if 'reload-configuration' in batch:
+            logger.debug('Reloading Upstart configuration...')
+            _run('initctl', 'reload-configuration')
+        for name in batch.get('start'):
+            _start(name, logger)
+
+    def status(self, name='', names=None):
+        """Return the statuses of the `name` job, of the `names` jobs
+        (names or glob patterns) or of all jobs.
+        """
+        super(Upstart, self).status(name=name)
+        self.services['services'] = list(self.status_iter(name, names))
+        return self.services
 
-    def status(self, name=''):
-        raise NotImplementedError()
+    def status_iter(self, name='', names=None):
+        """Yield the status of each job while parsing the output of
+        a single `initctl list` call.
+
+        Jobs are filtered by name after they're parsed as `initctl list`
+        doesn't filter them.
+        """
+        patterns = [n for n in [name] + list(names or []) if n]
+        missing = set(p for p in patterns if not utils.is_glob(p))
+        # A single regex matching any of the patterns is much faster than
+        # matching each of the patterns separately.
+        matches = re.compile('|'.join(
+            fnmatch.translate(p) for p in patterns)).match
+        for line in _run('initctl', 'list', _iter=True):
+            if patterns:
+                job = line.split(' ', 1)[0]
+                if not matches(job):
+                    continue
+                missing.discard(job)
+            status = self._parse_job_status(line)
+            if status is not None:
+                yield status
+        for job in sorted(missing):
+            yield self._create_status(
+                name=job, load='not-found', active='inactive', sub='waiting')
+
+    @classmethod
+    def _parse_job_status(cls, line):
+        """Return the status of the job in a line of `initctl list`'s
+        output or None if it isn't a job's line (e.g. it lists one of
+        the job's additional processes).
+        """
+        match = JOB_STATUS.match(line)
+        if not match:
+            return None
+        job = match.groupdict()
+        if job['state'] == 'running':
+            active = 'active'
+        elif job['goal'] == 'start':
+            active = 'activating'
+        elif job['state'] == 'waiting':
+            active = 'inactive'
+        else:
+            active = 'deactivating'
+        name = job['name']
+        if job['instance']:
+            name = '{0} ({1})'.format(name, job['instance'])
+        return cls._create_status(
+            name=name,
+            load='loaded',
+            active=active,
+            sub=job['state'],
+            pid=int(job['pid']) if job['pid'] else None)
 
     @staticmethod
     def is_system_exists():
@@ -62,12 +191,47 @@ class Upstart(Base):
     def is_service_exists(self):
         return os.path.isfile(self.svc_file_dest)
 
+    def is_configured(self):
+        """Return True if Upstart already knows the job.
+        """
+        try:
+            _run('initctl', 'status', self.name)
+        except sh.ErrorReturnCode:
+            return False
+        return True
+
+    def is_running(self):
+        """Return True if the job's state is one in which its main
+        process is running.
+
+        `initctl status` returns `<name> <goal>/<state>[, process <pid>]`
+        (e.g. `ssh start/running, process 1234`).
+        """
+        try:
+            output = str(_run('initctl', 'status', self.name))
+        except sh.ErrorReturnCode:
+            return False
+        match = re.search(r'\s\w+/([\w-]+)', output)
+        return bool(match) and match.group(1) in RUNNING_STATES
+
     def validate_platform(self):
         if utils.IS_WIN or utils.IS_DARWIN:
             raise ServError(
                 'Cannot install Upstart service on non-Linux systems.')
 
 
+def _run(command, *args, **kwargs):
+    with profiling.timer(command, ' '.join(args)):
+        return getattr(sh, command)(*args, **kwargs)
+
+
+def _start(name, logger):
+    try:
+        _run('start', name)
+    except:
+        logger.info('Service already started.')
+
+
 def is_system_exists():
     try:
         try:
@@ -0,0 +1,159 @@
+"""Readiness probes which tell whether a started service is actually
+ready to serve (e.g. is listening on its port) rather than only running.
+
+A probe is either a string or a dict. The supported probes are:
+
+    tcp:[HOST:]PORT         dict(type='tcp', host=HOST, port=PORT)
+    http(s)://HOST/PATH     dict(type='http', url=URL)
+    unix:PATH               dict(type='unix', path=PATH)
+    file:PATH               dict(type='file', path=PATH)
+    cmd:COMMAND             dict(type='cmd', command=COMMAND)
+
+An HTTP probe passes if the response's status is 2xx, a Unix socket probe
+passes once the socket exists and a command probe passes once it exits
+with 0. Dicts may also provide the `timeout` in seconds for the probe to
+pass (see `wait`).
+"""
+import os
+import stat
+import socket
+
+from . import utils
+from . import constants
+from . import profiling
+from .exceptions import ServError
+
+
+PROBE_TYPES = ('tcp', 'http', 'unix', 'file', 'cmd')
+
+
+def parse(probe, name=''):
+    """Return the dict form of `probe` (a string or a dict).
+
+    `{name}` in any of the probe's values is replaced with `name` so that
+    the same probe can be used for multiple services.
+    """
+    if isinstance(probe, dict):
+        probe = dict(probe)
+    else:
+        probe_type, _, value = str(probe).partition(':')
+        if probe_type in ('http', 'https'):
+            probe = dict(type='http', url=probe)
+        elif probe_type == 'tcp':
+            host, _, port = value.rpartition(':')
+            probe = dict(type='tcp', host=host, port=port)
+        elif probe_type in ('unix', 'file'):
+            probe = dict(type=probe_type, path=value)
+        elif probe_type == 'cmd':
+            probe = dict(type='cmd', command=value)
+        else:
+            probe = dict(type=probe_type)
+
+    if probe.get('type') not in PROBE_TYPES:
+        raise ServError(
+            'Probe type must be one of {0}. You provided: {1}'.format(
+                ', '.join(PROBE_TYPES), probe))
+    for key, value in probe.items():
+        if name and hasattr(value, 'replace'):
+            probe[key] = value.replace('{name}', name)
+
+    probe['timeout'] = float(
+        probe.get('timeout') or constants.DEFAULT_WAIT_TIMEOUT)
+    if probe['type'] == 'tcp':
+        probe['host'] = probe.get('host') or '127.0.0.1'
+        try:
+            probe['port'] = int(probe.get('port'))
+        except (ValueError, TypeError):
+            raise ServError('A tcp probe must provide a port. '
+                            'You provided: {0}'.format(probe))
+    required = dict(http='url', unix='path', file='path', cmd='command')
+    if probe['type'] in required and not probe.get(required[probe['type']]):
+        raise ServError('A {0} probe must provide a `{1}`. '
+                        'You provided: {2}'.format(
+                            probe['type'], required[probe['type']], probe))
+    return probe
+
+
+def check(probe):
+    """Return True if the parsed `probe` (see `parse`) passes.
+    """
+    with profiling.timer('probe', probe['type']):
+        return _CHECKS[probe['type']](probe)
+
+
+def wait(probe, name, timeout=None):
+    """Wait for the `name` service to pass `probe` by checking it with an
+    exponential backoff.
+
+    Raise if the probe didn't pass within `timeout` seconds (which defaults
+    to the probe's own `timeout`).
+    """
+    probe = parse(probe, name)
+    timeout = probe['timeout'] if timeout is None else timeout
+    if not utils.wait_for(lambda: check(probe), timeout):
+        raise ServError(
+            'Service {0} is not ready after {1} seconds ({2} probe '
+            'failed)'.format(name, timeout, probe['type']))
+
+
+def _check_tcp(probe):
+    try:
+        connection = socket.create_connection(
+            (probe['host'], probe['port']),
+            timeout=constants.PROBE_ATTEMPT_TIMEOUT)
+    except (socket.error, socket.timeout):
+        return False
+    connection.close()
+    return True
+
+
+def _check_http(probe):
+    try:
+        from urllib.request import urlopen
+        from urllib.error import URLError
+        from http.client import HTTPException
+    except ImportError:
+        from urllib2 import urlopen, URLError
+        from httplib import HTTPException
+
+    try:
+        response = urlopen(
+            probe['url'], timeout=constants.PROBE_ATTEMPT_TIMEOUT)
+    except (URLError, HTTPException, socket.error, socket.timeout):
+        # This includes HTTP errors (e.g. 503) as well as services which
+        # are still starting and drop the connection (e.g. BadStatusLine).
+        return False
+    try:
+        return 200 <= response.getcode() < 300
+    finally:
+        response.close()
+
+
+def _check_unix(probe):
+    try:
+        return stat.S_ISSOCK(os.stat(probe['path']).st_mode)
+    except OSError:
+        return False
+
+
+def _check_file(probe):
+    return os.path.exists(probe['path'])
+
+
+def _check_cmd(probe):
+    import shlex
+
+    try:
+        return utils.run(shlex.split(probe['command']))[0] == 0
+    except OSError as ex:
+        raise ServError('Failed to run probe command {0}: {1}'.format(
+            probe['command'], ex))
+
+
+_CHECKS = dict(
+    tcp=_check_tcp,
+    http=_check_http,
+    unix=_check_unix,
+    file=_check_file,
+    cmd=_check_cmd,
+)
@@ -0,0 +1,107 @@
+"""Lightweight timing instrumentation.
+
+Timing is disabled by default and is enabled either by calling `enable`
+(e.g. using the CLI's `--profile` flag) or by setting the `SERV_PROFILE`
+env var. While disabled, `timer` returns a shared no-op context manager
+so instrumented code pays practically nothing.
+"""
+import os
+import time
+import functools
+import threading
+
+from . import constants
+
+
+_enabled = bool(os.environ.get(constants.PROFILE_ENV_VAR))
+_records = []
+_started = time.time()
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class _Timer(object):
+    def __init__(self, phase, name):
+        self.phase = phase
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *args):
+        ended = time.time()
+        _records.append(dict(
+            phase=self.phase,
+            name=self.name,
+            thread=threading.current_thread().name,
+            started_ms=round((self.started - _started) * 1000, 3),
+            duration_ms=round((ended - self.started) * 1000, 3)))
+        return False
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def is_enabled():
+    return _enabled
+
+
+def timer(phase, name=None):
+    """Return a context manager which records the time it took to run
+    the `phase` (e.g. `render`) for `name` (e.g. the template's name).
+    """
+    if not _enabled:
+        return _null_timer
+    return _Timer(phase, name)
+
+
+def timed(phase):
+    """Decorate a function so that its calls are recorded as `phase`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Timer(phase, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report(operation=None):
+    """Return the timing breakdown of everything recorded so far.
+
+    The breakdown contains the total time spent in each phase, the number
+    of times each phase was recorded and each of the records, ordered by the
+    time they started.
+    """
+    phases = {}
+    for record in _records:
+        phase = phases.setdefault(
+            record['phase'], dict(count=0, total_ms=0))
+        phase['count'] += 1
+        phase['total_ms'] = round(phase['total_ms'] + record['duration_ms'], 3)
+    return dict(
+        operation=operation,
+        total_ms=round((time.time() - _started) * 1000, 3),
+        phases=phases,
+        records=sorted(_records, key=lambda r: r['started_ms']))
+
+
+def reset():
+    global _started
+    del _records[:]
+    _started = time.time()
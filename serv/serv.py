@@ -1,27 +1,26 @@
 import os
 import sys
 import json
-import time
 import logging
+import contextlib
 
-try:
-    import distro
-except ImportError:
-    pass
 import click
 
-from .init.sysv import SysV
-from .init.nssm import Nssm
-from .init.upstart import Upstart
-from .init.systemd import SystemD
-
 from . import utils
 from . import constants
+from . import profiling
 from .exceptions import ServError
+from .init.base import (
+    Batch,
+    NUMA_POLICIES,
+    CPU_SCHEDULING_POLICIES,
+    IO_SCHEDULING_CLASSES)
 
 
 def setup_logger():
-    handler = logging.StreamHandler(sys.stdout)
+    # Logs go to stderr so that they don't mix with the JSON which is
+    # printed to stdout (e.g. by `status --format ndjson`).
+    handler = logging.StreamHandler(sys.stderr)
     formatter = logging.Formatter('%(levelname)s - %(message)s')
     handler.setFormatter(formatter)
     logger = logging.getLogger(__name__)
@@ -33,20 +32,41 @@ def setup_logger():
 logger = setup_logger()
 
 
+# Implementations are either classes or `module:class` strings which are
+# only imported once the init system is used (see `_load_implementation`).
 INIT_SYSTEM_MAPPING = {
-    'sysv': SysV,
-    'systemd': SystemD,
-    'upstart': Upstart,
-    'nssm': Nssm
+    'sysv': 'serv.init.sysv:SysV',
+    'systemd': 'serv.init.systemd:SystemD',
+    'upstart': 'serv.init.upstart:Upstart',
+    'nssm': 'serv.init.nssm:Nssm'
 }
 
 
+def _load_implementation(implementation):
+    """Return the implementation class for an `INIT_SYSTEM_MAPPING` value.
+    """
+    if isinstance(implementation, type):
+        return implementation
+    module_name, class_name = implementation.split(':')
+    return getattr(__import__(module_name, fromlist=[class_name]), class_name)
+
+
+# Init systems detected in this process (see `Serv.lookup_init_systems`).
+_detected_init_systems = []
+
+
 class Serv(object):
     def __init__(self,
                  init_system=None,
-                 verbose=False):
+                 verbose=False,
+                 cache_init_system=True):
+        """`cache_init_system` allows to disable caching of the detected
+        init system (see `lookup_init_systems`).
+        """
         logger.setLevel(logging.DEBUG if verbose else logging.INFO)
 
+        self.cache_init_system = cache_init_system and not os.environ.get(
+            constants.DISABLE_INIT_SYSTEM_CACHE_ENV_VAR)
         if not init_system:
             result = self.lookup_init_systems()
             if not result:
@@ -66,7 +86,9 @@ class Serv(object):
                 'https://github.com/nir0s/serv/issues'.format(
                     self.init_system))
 
-        self.implementation = INIT_SYSTEM_MAPPING[self.init_system]
+        self.implementation = _load_implementation(
+            INIT_SYSTEM_MAPPING[self.init_system])
+        self._batch = None
 
     def _parse_service_env_vars(self, env_vars):
         """Return a dict based on `key=value` pair strings.
@@ -95,6 +117,20 @@ class Serv(object):
             'executable: %s', name)
         return name
 
+    def _get_service_params(self, cmd, name, params):
+        """Return the parameters of a service based on the parameters
+        already set for this instance.
+        """
+        service_params = dict(self.params)
+        service_params.update(**params)
+        service_params.update(dict(
+            cmd=cmd,
+            name=name,
+            env=self._parse_service_env_vars(
+                service_params.pop('var', '')))
+        )
+        return service_params
+
     def generate(self,
                  cmd,
                  name='',
@@ -108,41 +144,412 @@ class Serv(object):
         deploy them to the tmp dir on your os.
 
         If `deploy` is True, the service will be configured to run on the
-        current machine.
-        If `start` is True, the service will be started as well.
+        current machine. Deployed files which didn't change are left as is.
+        If `start` is True, the service will be started as well and, if
+        a readiness `probe` is provided (see `serv.probes`), this only
+        returns once the service passes it.
         """
         # TODO: parsing env vars and setting the name should probably be under
         # `base.py`.
         name = name or self._set_service_name_from_command(cmd)
-        self.params.update(**params)
-        self.params.update(dict(
-            cmd=cmd,
-            name=name,
-            env=self._parse_service_env_vars(params.get('var', '')))
-        )
-        if 'var' in params:
-            self.params.pop('var')
-        init = self.implementation(logger=logger, **self.params)
+        self.params = self._get_service_params(cmd, name, params)
+        init = self._create_implementation(self.params)
+
+        files = self._generate_files(init, overwrite)
+        if deploy or start:
+            self._deploy(init)
+            if start:
+                self._start(init)
+            logger.info('Service created')
+        return files
 
+    def _generate_files(self, init, overwrite):
         logger.info(
             'Generating %s files for service %s...',
-            self.init_system, name)
+            self.init_system, init.name)
         files = init.generate(overwrite=overwrite)
         for f in files:
             logger.info('Generated %s', f)
+        return files
 
-        if deploy or start:
-            init.validate_platform()
-            logger.info('Deploying %s service %s...', self.init_system, name)
-            init.install()
+    def _deploy(self, init):
+        init.validate_platform()
+        logger.info('Deploying %s service %s...', self.init_system, init.name)
+        init.install()
+        for destination, state in sorted(init.file_states.items()):
+            logger.info('%s: %s', destination, state)
 
-            if start:
-                logger.info(
-                    'Starting %s service %s...',
-                    self.init_system, name)
-                init.start()
-            logger.info('Service created')
-        return files
+    def _start(self, init):
+        logger.info('Starting %s service %s...', self.init_system, init.name)
+        init.start()
+        probe = init.params.get('probe')
+        # While batching, the service may only be started once the batch
+        # is committed.
+        if probe and init.batch is None:
+            from . import probes
+
+            logger.info('Waiting for service %s to be ready...', init.name)
+            probes.wait(probe, init.name)
+
+    def apply(self,
+              specs,
+              overwrite=False,
+              deploy=False,
+              start=False,
+              jobs=constants.DEFAULT_APPLY_JOBS):
+        """Generate (and optionally deploy and start) multiple services
+        and return a list of the results for each of them.
+
+        See `apply_iter` for more information.
+        """
+        return list(self.apply_iter(specs, overwrite, deploy, start, jobs))
+
+    def apply_iter(self,
+                   specs,
+                   overwrite=False,
+                   deploy=False,
+                   start=False,
+                   jobs=constants.DEFAULT_APPLY_JOBS):
+        """Generate (and optionally deploy and start) multiple services
+        concurrently and yield the result for each service as soon as
+        it's done.
+
+        `specs` is a list of dicts, each accepting the same parameters as
+        `generate` (e.g. `cmd`, `name`, `args`, `var`, `deploy`, etc..).
+        `overwrite`, `deploy` and `start` serve as defaults for specs which
+        don't explicitly provide them.
+        `jobs` is the maximum number of services handled concurrently.
+
+        All services are deployed in a single batch (see `batch`) and only
+        then started. Services are started in waves according to the
+        services they `require` or should be started `after` (see
+        `start_all`). Services whose required services failed are not
+        started.
+
+        Each result is a dict containing the `name` of the service,
+        the `files` generated for it, whether it was `deployed` and
+        `started`, the `file_states` of the deployed files (see
+        `Base.deploy_service_file`) and the `error` which occurred while
+        handling it, if any.
+        A failure to handle one service does not affect the others.
+        """
+        def set_error(service, ex):
+            logger.error('Failed to apply service %s: %s',
+                         service['result']['name'], ex)
+            service['result']['error'] = str(ex)
+
+        services = []
+        # Services whose spec is invalid (e.g. lacks a `cmd`).
+        invalid = []
+        for name, spec in self._get_named_specs(specs):
+            spec = dict(spec)
+            service = dict(
+                overwrite=spec.pop('overwrite', overwrite),
+                deploy=spec.pop('deploy', deploy),
+                start=spec.pop('start', start),
+                init=None,
+                result=dict(
+                    name=name,
+                    files=[],
+                    file_states={},
+                    deployed=False,
+                    started=False,
+                    error=None))
+            try:
+                cmd = spec.pop('cmd', None)
+                if not cmd:
+                    raise ServError(
+                        'All services must provide a `cmd`. '
+                        'You provided: {0}'.format(spec))
+                spec.pop('name', None)
+                service['params'] = self._get_service_params(cmd, name, spec)
+            except Exception as ex:
+                set_error(service, ex)
+                invalid.append(service)
+            else:
+                services.append(service)
+        for service in invalid:
+            yield service['result']
+
+        # We don't want a single faulty service to fail all others which is
+        # why any error is caught and reported as part of the result.
+        def deploy_service(service):
+            result = service['result']
+            try:
+                service['init'] = self._create_implementation(
+                    service['params'])
+                result['files'] = self._generate_files(
+                    service['init'], service['overwrite'])
+                if service['deploy'] or service['start']:
+                    self._deploy(service['init'])
+                    result['deployed'] = True
+                    result['file_states'] = service['init'].file_states
+            except Exception as ex:
+                set_error(service, ex)
+            return service
+
+        def start_service(service, wait):
+            try:
+                self._start(service['init'])
+                # Services in later waves may depend on this one.
+                if wait:
+                    service['init'].wait_for_state(
+                        True, constants.DEFAULT_WAIT_TIMEOUT)
+                service['result']['started'] = True
+            except Exception as ex:
+                set_error(service, ex)
+            return service
+
+        if not services:
+            return
+        # Fail before deploying anything if the dependencies are cyclic.
+        self._get_dependency_waves(
+            dict((s['result']['name'], s['params']) for s in services))
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(jobs, len(services)))
+        try:
+            deployed = []
+            try:
+                with self.batch():
+                    for service in pool.imap_unordered(
+                            deploy_service, services):
+                        if service['result']['error']:
+                            yield service['result']
+                        else:
+                            deployed.append(service)
+            except Exception as ex:
+                for service in deployed:
+                    set_error(service, ex)
+
+            to_start = {}
+            for service in deployed:
+                # The batch was committed so services must now be started
+                # immediately rather than deferring it to the batch.
+                service['init'].batch = None
+                if service['start'] and not service['result']['error']:
+                    to_start[service['result']['name']] = service
+                else:
+                    yield service['result']
+            failed = set(s['result']['name'] for s in services + invalid
+                         if s['result']['error'])
+            waves = self._get_dependency_waves(
+                dict((name, s['params']) for name, s in to_start.items()))
+            for index, wave in enumerate(waves):
+                wait = index < len(waves) - 1
+                starting = []
+                for name in wave:
+                    service = to_start[name]
+                    failed_requirements = [
+                        r for r in service['init'].params['requires']
+                        if r in failed]
+                    if failed_requirements:
+                        set_error(service, 'Required services failed: '
+                                           '{0}'.format(', '.join(
+                                               failed_requirements)))
+                        failed.add(name)
+                        yield service['result']
+                    else:
+                        starting.append(service)
+                for service in pool.imap_unordered(
+                        lambda s: start_service(s, wait), starting):
+                    if service['result']['error']:
+                        failed.add(service['result']['name'])
+                    yield service['result']
+        finally:
+            pool.terminate()
+
+    def start_all(self,
+                  specs,
+                  wait=False,
+                  timeout=constants.DEFAULT_WAIT_TIMEOUT,
+                  jobs=constants.DEFAULT_APPLY_JOBS):
+        """Start all (already deployed) services in `specs` (see
+        `apply_iter`) while respecting the dependencies between them.
+
+        Services are started in waves so that each service is only started
+        once all services it `requires` or should be started `after` are
+        running. The services in each wave are started concurrently (up to
+        `jobs` at a time), so services are brought up as fast as their
+        dependencies allow. Dependencies on services which aren't in `specs`
+        are ignored.
+
+        The services of each wave are waited for (up to `timeout` seconds)
+        to start before starting the next wave. If `wait` is True, the
+        services of the last wave are waited for as well.
+        If any of the services in a wave fails to start, later waves
+        aren't started.
+        """
+        self._perform_in_waves('start', specs, wait, timeout, jobs)
+
+    def stop_all(self,
+                 specs,
+                 wait=False,
+                 timeout=constants.DEFAULT_WAIT_TIMEOUT,
+                 jobs=constants.DEFAULT_APPLY_JOBS):
+        """Stop all services in `specs` in the reverse order of
+        `start_all`, so that each service is only stopped once all services
+        depending on it have stopped.
+        """
+        self._perform_in_waves('stop', specs, wait, timeout, jobs)
+
+    def rolling_restart(self,
+                        pattern,
+                        max_unavailable=1,
+                        timeout=constants.DEFAULT_WAIT_TIMEOUT,
+                        health_cmd=None,
+                        probe=None):
+        """Restart all services matching `pattern` (a name or a glob
+        pattern) in batches of `max_unavailable` services and return the
+        names of the restarted services.
+
+        The services in each batch are restarted concurrently and the next
+        batch is only restarted once all of them are running again (waiting
+        up to `timeout` seconds) and pass the readiness `probe` (see
+        `serv.probes`) and `health_cmd`, if provided. `health_cmd` is a
+        shorthand for a `cmd` probe. Probes are retried with a backoff for
+        up to `timeout` seconds. `{name}` in probes is replaced with the
+        service's name (e.g. `curl -fs http://localhost/{name}/health`).
+
+        If any service in a batch fails to restart or isn't healthy, the
+        rollout is aborted and the remaining batches aren't restarted.
+        """
+        from . import probes
+
+        readiness_probes = [probes.parse(p) for p in (
+            probe, health_cmd and dict(type='cmd', command=health_cmd)) if p]
+        names = self._get_implementation('').list_services(pattern)
+        if not names:
+            raise ServError('No services match {0}'.format(pattern))
+        batches = [names[i:i + max_unavailable]
+                   for i in range(0, len(names), max_unavailable)]
+
+        def restart(name):
+            init = self._create_implementation(dict(self.params, name=name))
+            try:
+                init.restart(timeout)
+                init.wait_for_state(True, timeout)
+                for readiness_probe in readiness_probes:
+                    probes.wait(readiness_probe, name, timeout)
+            except Exception as ex:
+                return '{0}: {1}'.format(name, ex)
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(max_unavailable, len(names)))
+        restarted = []
+        try:
+            for index, batch in enumerate(batches):
+                logger.info('Restarting batch %s/%s: %s...',
+                            index + 1, len(batches), ', '.join(batch))
+                errors = [e for e in pool.map(restart, batch) if e]
+                if errors:
+                    raise ServError(
+                        'Rollout aborted after restarting {0} of {1} '
+                        'services: {2}'.format(
+                            len(restarted), len(names), '; '.join(errors)))
+                restarted.extend(batch)
+        finally:
+            pool.terminate()
+        logger.info('Restarted %s services', len(restarted))
+        return restarted
+
+    def _perform_in_waves(self, action, specs, wait, timeout, jobs):
+        waves = self._get_dependency_waves(dict(self._get_named_specs(specs)))
+        if not waves:
+            return
+        if action == 'stop':
+            waves.reverse()
+        last_wave = set(waves[-1])
+
+        def perform(name):
+            # Unlike `_get_implementation`, this doesn't update the shared
+            # params as multiple services are handled concurrently.
+            init = self._create_implementation(dict(self.params, name=name))
+            try:
+                self._assert_service_installed(init, name)
+                logger.info('%s service: %s...',
+                            'Starting' if action == 'start' else 'Stopping',
+                            name)
+                getattr(init, action)()
+                if wait or name not in last_wave:
+                    init.wait_for_state(action == 'start', timeout)
+            except Exception as ex:
+                return '{0}: {1}'.format(name, ex)
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(jobs, max(len(wave) for wave in waves)))
+        try:
+            for wave in waves:
+                errors = [e for e in pool.map(perform, wave) if e]
+                if errors:
+                    raise ServError('Failed to {0} services: {1}'.format(
+                        action, '; '.join(errors)))
+        finally:
+            pool.terminate()
+
+    def _get_named_specs(self, specs):
+        """Return a list of the name of each service in `specs` along
+        with its spec, in the order of `specs`.
+        """
+        named_specs = []
+        names = set()
+        for spec in specs:
+            name = spec.get('name')
+            if not name and spec.get('cmd'):
+                name = self._set_service_name_from_command(spec['cmd'])
+            if not name:
+                raise ServError(
+                    'All services must provide a `name` or a `cmd`. '
+                    'You provided: {0}'.format(spec))
+            if name in names:
+                raise ServError(
+                    'Service {0} is defined more than once'.format(name))
+            names.add(name)
+            named_specs.append((name, spec))
+        return named_specs
+
+    @staticmethod
+    def _get_dependency_waves(specs_by_name):
+        """Return the names of the services in `specs_by_name` grouped
+        into waves (see `utils.get_dependency_waves`) according to the
+        services they `require` or should be started `after`.
+        """
+        return utils.get_dependency_waves(dict(
+            (name, set(utils.to_list(spec.get('requires'))) |
+             set(utils.to_list(spec.get('after'))))
+            for name, spec in specs_by_name.items()))
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Defer init system operations until the end of the block.
+
+        While in a batch, operations which affect the init system as a
+        whole (e.g. `systemctl enable`, `systemctl daemon-reload` or
+        `initctl reload-configuration`) are not performed per service.
+        Instead, they're collected and performed once when the block
+        exits, for all services. Starting a service may also be deferred
+        if the init system requires it to be reloaded first.
+
+        For instance:
+
+            with serv.batch():
+                serv.generate('/usr/bin/a', deploy=True)
+                serv.generate('/usr/bin/b', deploy=True)
+
+        will only run `systemctl enable a b` and `systemctl daemon-reload`
+        once, after both services were deployed.
+        Nested batches are merged into the outermost one.
+        """
+        if self._batch is not None:
+            yield
+            return
+        self._batch = Batch()
+        try:
+            yield
+        finally:
+            batch, self._batch = self._batch, None
+            if batch:
+                logger.debug('Committing batch: %s', batch)
+                self.implementation.commit_batch(batch, logger)
 
     def remove(self, name):
         """Remove a service completely.
@@ -159,51 +566,128 @@ class Serv(object):
         init.uninstall()
         logger.info('Service removed')
 
-    def status(self, name=''):
+    def status(self, name='', names=None):
         """Return a list containing a single service's info if `name`
         is supplied, else returns a list of all services' info.
+
+        `names` is a list of service names or glob patterns
+        (e.g. `web-*`). If provided, the info of all matching services
+        is retrieved at once.
+        """
+        return self._get_status_implementation(name).status(
+            name, names=names)
+
+    def status_iter(self, name='', names=None):
+        """Yield the info of each service (see `status`) as soon as
+        it's retrieved rather than retrieving the info of all services
+        before returning it.
+        """
+        return self._get_status_implementation(name).status_iter(
+            name, names=names)
+
+    def watch(self,
+              name='',
+              names=None,
+              interval=constants.DEFAULT_WATCH_INTERVAL):
+        """Yield an event whenever the state of the `name` service,
+        of the `names` services (names or glob patterns) or of any
+        service changes.
+
+        Where the init system can't notify about changes, the statuses
+        are polled every `interval` seconds.
+        """
+        return self._get_status_implementation(name).watch(
+            name, names=names, interval=interval)
+
+    def stats(self, name='', names=None):
+        """Return the resource usage (memory, CPU time, tasks and IO)
+        of the `name` service, of the `names` services (names or glob
+        patterns) or of all services.
         """
-        logger.warn(
+        return self._get_implementation(name).stats(name, names=names)
+
+    def _get_status_implementation(self, name):
+        logger.warning(
             'Note that `status` is currently not so robust and may break on '
             'different systems')
         init = self._get_implementation(name)
-        if name:
+        if name and not utils.is_glob(name):
             self._assert_service_installed(init, name)
         logger.info('Retrieving status...')
-        return init.status(name)
+        return init
 
-    def stop(self, name):
+    def stop(self, name, wait=False, timeout=constants.DEFAULT_WAIT_TIMEOUT):
         """Stop a service
+
+        If `wait` is True, wait up to `timeout` seconds for the service
+        to stop.
         """
         init = self._get_implementation(name)
         self._assert_service_installed(init, name)
         logger.info('Stopping service: %s...', name)
         init.stop()
+        if wait:
+            init.wait_for_state(False, timeout)
 
-    def start(self, name):
+    def start(self, name, wait=False, timeout=constants.DEFAULT_WAIT_TIMEOUT):
         """Start a service
+
+        If `wait` is True, wait up to `timeout` seconds for the service
+        to start.
         """
         init = self._get_implementation(name)
         self._assert_service_installed(init, name)
         logger.info('Starting service: %s...', name)
         init.start()
+        if wait:
+            init.wait_for_state(True, timeout)
 
-    def restart(self, name):
+    def restart(self,
+                name,
+                wait=False,
+                timeout=constants.DEFAULT_WAIT_TIMEOUT):
         """Restart a service
+
+        The init system's native restart is used where available. Otherwise,
+        the service is only started once it has actually stopped.
+        If `wait` is True, also wait up to `timeout` seconds for the service
+        to start.
         """
         init = self._get_implementation(name)
         self._assert_service_installed(init, name)
         logger.info('Restarting service: %s...', name)
-        init.stop()
-        # Here we would use status to verify that the service stopped
-        # before restarting. If only status was stable. eh..
-        # The arbitrarity of this sleep time is making me sick...
-        time.sleep(3)
-        init.start()
+        init.restart(timeout)
+        if wait:
+            init.wait_for_state(True, timeout)
+
+    def scale(self, name, count, pin_cpus=False):
+        """Converge the number of running instances of the `name` template
+        service (e.g. `worker` for systemd's `worker@.service`) to `count`
+        and return the result (see `SystemD.scale`).
+
+        If `pin_cpus` is True, each instance is pinned to a separate CPU.
+        """
+        if not name.endswith('@'):
+            name += '@'
+        init = self._get_implementation(name)
+        self._assert_service_installed(init, name)
+        logger.info('Scaling service %s to %s instances...', name, count)
+        return init.scale(count, pin_cpus)
+
+    def reload(self, name):
+        """Reload a service's configuration without restarting it
+        """
+        init = self._get_implementation(name)
+        self._assert_service_installed(init, name)
+        logger.info('Reloading service: %s...', name)
+        init.reload()
 
     def _get_implementation(self, name):
         self.params.update(dict(name=name))
-        return self.implementation(logger=logger, **self.params)
+        return self._create_implementation(self.params)
+
+    def _create_implementation(self, params):
+        return self.implementation(logger=logger, batch=self._batch, **params)
 
     @staticmethod
     def _assert_service_installed(init, name):
@@ -211,6 +695,7 @@ class Serv(object):
             raise ServError('Service {0} does not seem to be installed'.format(
                 name))
 
+    @profiling.timed('lookup_init_systems')
     def lookup_init_systems(self):
         """Return the relevant init system and its version.
 
@@ -218,6 +703,11 @@ class Serv(object):
         doesn't exist, it will try to identify it automatically.
 
         Windows lookup is not supported and `nssm` is assumed.
+
+        Unless `cache_init_system` is False, the result is cached both
+        in-process and on disk. The cache on disk is invalidated whenever
+        `/etc/os-release` or the executable of the init process
+        (`/proc/1/exe`) change.
         """
         if utils.IS_WIN:
             logger.debug(
@@ -228,10 +718,53 @@ class Serv(object):
                 'Lookup is not supported on OS X, Assuming launchd...')
             return ['launchd']
 
+        if not self.cache_init_system:
+            return self._detect_init_systems()
+        if not _detected_init_systems:
+            _detected_init_systems.extend(self._get_cached_init_systems())
+        return list(_detected_init_systems)
+
+    def _detect_init_systems(self):
         logger.debug('Looking up init method...')
         return self._lookup_by_mapping() \
             or self._init_sys_auto_lookup()
 
+    def _get_cached_init_systems(self):
+        """Return the init systems cached on disk or detect them and cache
+        them if the cache doesn't exist or is outdated.
+        """
+        key = self._get_init_system_cache_key()
+        cache_path = utils.get_cache_dir(constants.INIT_SYSTEM_CACHE_FILE)
+        try:
+            with open(cache_path) as cache_file:
+                cache = json.load(cache_file)
+            if cache.get('key') == key and cache.get('init_systems'):
+                logger.debug('Using cached init systems from %s', cache_path)
+                return cache['init_systems']
+        except (IOError, OSError, ValueError):
+            pass
+
+        init_systems = self._detect_init_systems()
+        if init_systems:
+            try:
+                utils.write_json(
+                    cache_path, dict(key=key, init_systems=init_systems))
+            except (IOError, OSError) as ex:
+                logger.debug('Failed to cache init systems: %s', ex)
+        return init_systems
+
+    @staticmethod
+    def _get_init_system_cache_key():
+        key = []
+        for path in constants.INIT_SYSTEM_CACHE_KEY_PATHS:
+            try:
+                stat = os.stat(path)
+                key.append([path, stat.st_dev, stat.st_ino, stat.st_mtime])
+            # /proc/1/exe can't be resolved without elevated privileges.
+            except OSError:
+                key.append([path, None])
+        return key
+
     def _is_init_system_installed(self, path):
         return os.path.isdir(path)
 
@@ -272,6 +805,8 @@ class Serv(object):
         for Arch where the distro's ID changes (Manjaro, Antergos, etc...)
         But the "ID_LIKE" field is always (?) `arch`.
         """
+        import distro
+
         like = distro.like().lower()
         distribution_id = distro.id().lower()
         version = distro.major_version()
@@ -291,13 +826,68 @@ init_system_option = click.option(
     help='Init system to use. (If omitted, will attempt to automatically '
          'identify it.)')
 verbosity_option = click.option('-v', '--verbose', default=False, is_flag=True)
+wait_option = click.option(
+    '-w',
+    '--wait',
+    default=False,
+    is_flag=True,
+    help='Wait for the service to reach its desired state')
+timeout_option = click.option(
+    '-t',
+    '--timeout',
+    type=float,
+    default=constants.DEFAULT_WAIT_TIMEOUT,
+    help='Seconds to wait for the service to reach its desired state. '
+         '[Default: {0}]'.format(constants.DEFAULT_WAIT_TIMEOUT))
+jobs_option = click.option(
+    '-j',
+    '--jobs',
+    type=click.IntRange(1),
+    default=constants.DEFAULT_APPLY_JOBS,
+    help='Maximum number of services to handle concurrently. '
+         '[Default: {0}]'.format(constants.DEFAULT_APPLY_JOBS))
+all_option = click.option(
+    '--all',
+    'all_services',
+    default=False,
+    is_flag=True,
+    help='Handle all services in `--manifest` in the order of their '
+         'dependencies')
+manifest_option = click.option(
+    '-m',
+    '--manifest',
+    type=click.Path(exists=True, dir_okay=False),
+    help='A JSON or YAML manifest of services (see `apply`) to use '
+         'with `--all`')
+format_option = click.option(
+    '-f',
+    '--format',
+    'output_format',
+    type=click.Choice(['json', 'ndjson']),
+    default='json',
+    help='Output format. `ndjson` prints each service on a separate line '
+         'as soon as it\'s retrieved')
 
 
 @click.group()
-def main():
+@click.option('--profile',
+              default=False,
+              is_flag=True,
+              help='Print a JSON breakdown of the time spent in each phase of '
+                   'the command to stderr once done. This can also be enabled '
+                   'by setting the SERV_PROFILE env var.')
+@click.pass_context
+def main(ctx, profile):
     """Create, remove and manage services on different platforms using a single
     API
     """
+    if profile:
+        profiling.enable()
+    if profiling.is_enabled():
+        ctx.call_on_close(lambda: click.echo(json.dumps(
+            profiling.report(ctx.invoked_subcommand),
+            indent=4,
+            sort_keys=True), err=True))
 
 
 @main.command()
@@ -346,6 +936,19 @@ def main():
               default='/',
               help='Directory to change to before executing `cmd`. '
                    '[Default: /]')
+@click.option('--requires',
+              multiple=True,
+              help='A service which this service requires. The service is '
+                   'started after it. You can do this multiple times')
+@click.option('--after',
+              multiple=True,
+              help='A service which this service should be started after. '
+                   'You can do this multiple times')
+@click.option('-p',
+              '--probe',
+              help='A readiness probe which the service must pass after '
+                   'starting it: tcp:[HOST:]PORT, http(s)://URL, unix:PATH, '
+                   'file:PATH or cmd:COMMAND')
 @click.option('--nice',
               type=click.IntRange(-20, 19),
               help="process's `niceness` level. [-20 >< 19]")
@@ -389,6 +992,53 @@ def main():
               default=None,
               help="process's `limit-stack-size` level. "
                    '[`ulimited` || > 0 ]')
+@click.option('--cpu-quota',
+              help='Percentage of a single CPU the service may use. May be '
+                   'above 100% for multiple CPUs. [e.g. 50%]')
+@click.option('--cpu-weight',
+              type=click.IntRange(1, 10000),
+              help='Relative CPU share of the service. [1 >< 10000]')
+@click.option('--memory-high',
+              help='Memory above which the service is throttled. '
+                   '[e.g. 512M || infinity]')
+@click.option('--memory-max',
+              help='Memory above which the service is killed. '
+                   '[e.g. 1G || infinity]')
+@click.option('--tasks-max',
+              help='Maximum number of tasks (processes and threads) of the '
+                   'service. [> 0 || infinity]')
+@click.option('--io-weight',
+              type=click.IntRange(1, 10000),
+              help='Relative IO share of the service. [1 >< 10000]')
+@click.option('--cpu-affinity',
+              help='CPUs the service may run on. [e.g. 0-3,6]')
+@click.option('--numa-policy',
+              type=click.Choice(NUMA_POLICIES),
+              help='NUMA memory policy of the service')
+@click.option('--numa-mask',
+              help='NUMA nodes used by `--numa-policy`. [e.g. 0-1]')
+@click.option('--cpu-scheduling-policy',
+              type=click.Choice(CPU_SCHEDULING_POLICIES),
+              help='CPU scheduling policy of the service')
+@click.option('--cpu-scheduling-priority',
+              type=click.IntRange(1, 99),
+              help='Real-time priority, required by the fifo and rr '
+                   '`--cpu-scheduling-policy`. [1 >< 99]')
+@click.option('--io-scheduling-class',
+              type=click.Choice(IO_SCHEDULING_CLASSES),
+              help='I/O scheduling class of the service')
+@click.option('--io-scheduling-priority',
+              type=click.IntRange(0, 7),
+              help='I/O priority within `--io-scheduling-class`, 0 being '
+                   'the highest. [0 >< 7]')
+@click.option('--oom-score-adjust',
+              type=click.IntRange(-1000, 1000),
+              help='How likely the service is to be killed when out of '
+                   'memory. [-1000 >< 1000]')
+@click.option('--scheduling-profile',
+              type=click.Choice(sorted(constants.SCHEDULING_PROFILES)),
+              help='Scheduling preset. Explicitly provided scheduling '
+                   'options and `--nice` take precedence over it')
 @init_system_option
 @verbosity_option
 def generate(command,
@@ -412,6 +1062,47 @@ def generate(command,
         sys.exit(ex)
 
 
+@main.command()
+@click.argument('MANIFEST', type=click.Path(exists=True, dir_okay=False))
+@click.option('-d',
+              '--deploy',
+              default=False,
+              is_flag=True,
+              help='Deploy services which do not state otherwise')
+@click.option('-s',
+              '--start',
+              default=False,
+              is_flag=True,
+              help='Start services which do not state otherwise')
+@click.option('--overwrite',
+              default=False,
+              is_flag=True,
+              help='Overwrite services which do not state otherwise')
+@jobs_option
+@init_system_option
+@verbosity_option
+def apply(manifest, init_system, overwrite, deploy, start, jobs, verbose):
+    """Create multiple services.
+
+    `MANIFEST` is a JSON or YAML file containing a list of services. Each
+    service accepts the same parameters as `generate`.
+    A result is printed for each service once it's done.
+    """
+    failed = []
+    try:
+        specs = utils.load_manifest(manifest)
+        results = Serv(init_system, verbose=verbose).apply_iter(
+            specs, overwrite, deploy, start, jobs)
+        for result in results:
+            click.echo(json.dumps(result, sort_keys=True))
+            if result['error']:
+                failed.append(result['name'])
+    except ServError as ex:
+        sys.exit(ex)
+    if failed:
+        sys.exit('Failed to apply services: {0}'.format(', '.join(failed)))
+
+
 @main.command()
 @click.argument('name')
 @init_system_option
@@ -426,53 +1117,274 @@ def remove(name, init_system, verbose):
 
 
 @main.command()
-@click.argument('name', required=False)
+@click.argument('names', nargs=-1)
+@format_option
 @init_system_option
 @verbosity_option
-def status(name, init_system, verbose):
+def status(names, output_format, init_system, verbose):
     """WIP! Try at your own expense
+
+    Retrieve the status of all services or of the `NAMES` services.
+    Names may also be glob patterns (e.g. 'web-*').
     """
+    name = names[0] if len(names) == 1 else ''
+    names = list(names) if len(names) > 1 else None
     try:
-        status = Serv(init_system, verbose=verbose).status(name)
+        client = Serv(init_system, verbose=verbose)
+        if output_format == 'ndjson':
+            for service in client.status_iter(name, names=names):
+                click.echo(json.dumps(service, sort_keys=True))
+            return
+        status = client.status(name, names=names)
     except ServError as ex:
         sys.exit(ex)
     click.echo(json.dumps(status, indent=4, sort_keys=True))
 
 
 @main.command()
-@click.argument('name')
+@click.argument('names', nargs=-1)
+@format_option
 @init_system_option
 @verbosity_option
-def stop(name, init_system, verbose):
+def stats(names, output_format, init_system, verbose):
+    """Retrieve the resource usage of services
+
+    Retrieve the memory, CPU time, number of tasks and IO of all services
+    or of the `NAMES` services. Names may also be glob patterns.
+    This is currently only supported for systemd.
+    """
+    name = names[0] if len(names) == 1 else ''
+    names = list(names) if len(names) > 1 else None
+    try:
+        stats = Serv(init_system, verbose=verbose).stats(name, names=names)
+    except ServError as ex:
+        sys.exit(ex)
+    if output_format == 'ndjson':
+        for service in stats['services']:
+            click.echo(json.dumps(service, sort_keys=True))
+    else:
+        click.echo(json.dumps(stats, indent=4, sort_keys=True))
+
+
+@main.command()
+@click.argument('names', nargs=-1)
+@click.option('-i',
+              '--interval',
+              type=float,
+              default=constants.DEFAULT_WATCH_INTERVAL,
+              help='Seconds between polling the statuses where the init '
+                   'system can\'t notify about changes. '
+                   '[Default: {0}]'.format(constants.DEFAULT_WATCH_INTERVAL))
+@init_system_option
+@verbosity_option
+def watch(names, interval, init_system, verbose):
+    """Print an event whenever the state of a service changes
+
+    Watch all services or the `NAMES` services (names or glob patterns)
+    and print each change as a separate JSON line until interrupted.
+    """
+    name = names[0] if len(names) == 1 else ''
+    names = list(names) if len(names) > 1 else None
+    try:
+        client = Serv(init_system, verbose=verbose)
+        for event in client.watch(name, names=names, interval=interval):
+            click.echo(json.dumps(event, sort_keys=True))
+    except ServError as ex:
+        sys.exit(ex)
+    except KeyboardInterrupt:
+        pass
+
+
+def _load_all_services_manifest(name, all_services, manifest):
+    """Return the specs in `manifest` if all services should be handled
+    or None if only the `name` service should be.
+    """
+    if not all_services:
+        if manifest:
+            raise ServError('`--manifest` can only be used with `--all`')
+        if not name:
+            raise ServError(
+                'Either a service name or `--all` must be provided')
+        return None
+    if name:
+        raise ServError('A service name cannot be provided with `--all`')
+    if not manifest:
+        raise ServError('`--all` requires a `--manifest`')
+    return utils.load_manifest(manifest)
+
+
+@main.command()
+@click.argument('name', required=False)
+@all_option
+@manifest_option
+@jobs_option
+@wait_option
+@timeout_option
+@init_system_option
+@verbosity_option
+def stop(name,
+         all_services,
+         manifest,
+         jobs,
+         wait,
+         timeout,
+         init_system,
+         verbose):
     """Stop a service
+
+    With `--all`, stop all services in the manifest. Each service is only
+    stopped once all services depending on it have stopped.
     """
     try:
-        Serv(init_system, verbose=verbose).stop(name)
+        specs = _load_all_services_manifest(name, all_services, manifest)
+        client = Serv(init_system, verbose=verbose)
+        if specs is None:
+            client.stop(name, wait, timeout)
+        else:
+            client.stop_all(specs, wait, timeout, jobs)
     except ServError as ex:
         sys.exit(ex)
 
 
 @main.command()
-@click.argument('name')
+@click.argument('name', required=False)
+@all_option
+@manifest_option
+@jobs_option
+@wait_option
+@timeout_option
 @init_system_option
 @verbosity_option
-def start(name, init_system, verbose):
+def start(name,
+          all_services,
+          manifest,
+          jobs,
+          wait,
+          timeout,
+          init_system,
+          verbose):
     """Start a service
+
+    With `--all`, start all services in the manifest. Services which don't
+    depend on each other are started concurrently while each service is
+    only started once all services it `requires` or should be started
+    `after` are running.
     """
     try:
-        Serv(init_system, verbose=verbose).start(name)
+        specs = _load_all_services_manifest(name, all_services, manifest)
+        client = Serv(init_system, verbose=verbose)
+        if specs is None:
+            client.start(name, wait, timeout)
+        else:
+            client.start_all(specs, wait, timeout, jobs)
     except ServError as ex:
         sys.exit(ex)
 
 
 @main.command()
 @click.argument('name')
+@wait_option
+@timeout_option
 @init_system_option
 @verbosity_option
-def restart(name, init_system, verbose):
+def restart(name, wait, timeout, init_system, verbose):
     """Restart a service
     """
     try:
-        Serv(init_system, verbose=verbose).restart(name)
+        Serv(init_system, verbose=verbose).restart(name, wait, timeout)
     except ServError as ex:
         sys.exit(ex)
+
+
+@main.command('rolling-restart')
+@click.argument('PATTERN')
+@click.option('-k',
+              '--max-unavailable',
+              type=click.IntRange(1),
+              default=1,
+              help='Number of services to restart at a time. [Default: 1]')
+@click.option('--health-cmd',
+              help='A command which must exit with 0 for each restarted '
+                   'service before restarting the next batch. `{name}` is '
+                   'replaced with the name of the service')
+@click.option('-p',
+              '--probe',
+              help='A readiness probe (e.g. `tcp:8000`, '
+                   '`http://localhost:8000/{name}`) which each restarted '
+                   'service must pass before restarting the next batch')
+@timeout_option
+@init_system_option
+@verbosity_option
+def rolling_restart(pattern,
+                    max_unavailable,
+                    health_cmd,
+                    probe,
+                    timeout,
+                    init_system,
+                    verbose):
+    """Restart services in batches
+
+    Restart all services matching `PATTERN` (e.g. 'worker-*'),
+    `--max-unavailable` at a time, waiting for each batch to run again
+    (and pass `--probe` and `--health-cmd`) before restarting the next
+    one. The rollout is aborted on the first batch which fails.
+    """
+    try:
+        Serv(init_system, verbose=verbose).rolling_restart(
+            pattern, max_unavailable, timeout, health_cmd, probe)
+    except ServError as ex:
+        sys.exit(ex)
+
+
+@main.command()
+@click.argument('name')
+@click.argument('count', type=click.IntRange(0))
+@click.option('--pin-cpus',
+              default=False,
+              is_flag=True,
+              help='Pin each instance to a separate CPU')
+@init_system_option
+@verbosity_option
+def scale(name, count, pin_cpus, init_system, verbose):
+    """Scale a service to a number of instances
+
+    Start instances `1..COUNT` of the `NAME` template service (generated
+    using a name ending with `@`, e.g. `worker@`) and stop any others.
+    This is currently only supported for systemd.
+    """
+    try:
+        result = Serv(init_system, verbose=verbose).scale(
+            name, count, pin_cpus)
+    except ServError as ex:
+        sys.exit(ex)
+    click.echo(json.dumps(result, indent=4, sort_keys=True))
+
+
+@main.command()
+@click.argument('name')
+@init_system_option
+@verbosity_option
+def reload(name, init_system, verbose):
+    """Reload a service's configuration
+    """
+    try:
+        Serv(init_system, verbose=verbose).reload(name)
+    except ServError as ex:
+        sys.exit(ex)
+
+
+@main.group('cache')
+def cache_group():
+    """Manage Serv's local caches
+    """
+
+
+@cache_group.command('clear')
+def clear_cache():
+    """Remove rendered templates, compiled templates and the detected
+    init system from the cache
+    """
+    from . import cache
+
+    for path in cache.clear():
+        click.echo('Removed {0}'.format(path))
@@ -1,7 +1,11 @@
 import os
 import sys
-import tempfile
-import subprocess
+import json
+import time
+import errno
+
+from . import constants
+from .exceptions import ServError
 
 PLATFORM = sys.platform
 IS_WIN = (os.name == 'nt')
@@ -10,19 +14,176 @@ IS_LINUX = (PLATFORM == 'linux2')
 
 
 def run(executable):
+    import subprocess
+
+    from . import profiling
+
     stderr = subprocess.PIPE
     stdout = subprocess.PIPE
-    proc = subprocess.Popen(
-        executable,
-        stdout=stdout,
-        stderr=stderr)
-    out, err = proc.communicate()
+    with profiling.timer('run', executable):
+        proc = subprocess.Popen(
+            executable,
+            stdout=stdout,
+            stderr=stderr)
+        out, err = proc.communicate()
     return proc.returncode, out.rstrip(), err.rstrip()
 
 
+# `time.monotonic` is not available on Python 2.
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+def wait_for(predicate, timeout, interval=0.1, max_interval=2):
+    """Call `predicate` until it returns True or `timeout` seconds pass
+    and return whether it returned True.
+
+    The interval between calls starts at `interval` seconds and is doubled
+    after each call, up to `max_interval`.
+    """
+    deadline = _monotonic() + timeout
+    while not predicate():
+        remaining = deadline - _monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+    return True
+
+
+def get_file_hash(path):
+    """Return the SHA256 hex digest of the file in `path`.
+    """
+    import hashlib
+
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def is_glob(name):
+    """Return True if `name` is a glob pattern (e.g. `web-*`) rather
+    than a name.
+    """
+    return any(c in name for c in '*?[')
+
+
+def to_list(value):
+    """Return `value`, which is either a single item, a list of items
+    or None, as a list.
+    """
+    if not value:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
+
+
+def get_dependency_waves(dependencies):
+    """Return the names in `dependencies`, a dict mapping each name to the
+    names it depends on, grouped into waves so that each name only depends
+    on names in previous waves.
+
+    All names in a wave are independent of each other and can be handled
+    concurrently. Dependencies which aren't themselves in `dependencies`
+    are ignored.
+    """
+    dependants = dict((name, []) for name in dependencies)
+    remaining = {}
+    for name, depends_on in dependencies.items():
+        depends_on = set(d for d in depends_on if d in dependencies)
+        remaining[name] = len(depends_on)
+        for dependency in depends_on:
+            dependants[dependency].append(name)
+
+    waves = []
+    wave = sorted(name for name, count in remaining.items() if not count)
+    while wave:
+        waves.append(wave)
+        next_wave = []
+        for name in wave:
+            for dependant in dependants[name]:
+                remaining[dependant] -= 1
+                if not remaining[dependant]:
+                    next_wave.append(dependant)
+        wave = sorted(next_wave)
+
+    cyclic = sorted(name for name, count in remaining.items() if count)
+    if cyclic:
+        raise ServError('Services have circular dependencies: {0}'.format(
+            ', '.join(cyclic)))
+    return waves
+
+
 def get_tmp_dir(init_system, application_name):
+    import tempfile
+
     tmp_application_dir = os.path.join(
         tempfile.gettempdir(), init_system + '-' + application_name)
-    if not os.path.isdir(tmp_application_dir):
-        os.makedirs(tmp_application_dir)
+    makedirs(tmp_application_dir)
     return tmp_application_dir
+
+
+def get_cache_dir(*paths):
+    """Return the path to Serv's cache directory joined with `paths`.
+
+    The directory can be set using the `SERV_CACHE_DIR` env var and
+    otherwise defaults to `$XDG_CACHE_HOME/serv` (or `~/.cache/serv`).
+    """
+    cache_dir = os.environ.get(constants.CACHE_DIR_ENV_VAR)
+    if not cache_dir:
+        cache_dir = os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'), 'serv')
+    return os.path.join(cache_dir, *paths)
+
+
+def write_json(path, content):
+    """Atomically write `content` as JSON to `path`, creating its
+    directory if required.
+    """
+    makedirs(os.path.dirname(path))
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f)
+    os.rename(tmp_path, path)
+
+
+def makedirs(path, mode=0o777):
+    """Create `path` (with `mode`) unless it already exists.
+
+    This is safe to call concurrently for the same path.
+    """
+    try:
+        os.makedirs(path, mode)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def load_manifest(path):
+    """Return the list of service specs in the JSON or YAML file `path`.
+
+    The manifest can either be a list of specs or a dict containing
+    that list under `services`.
+    """
+    with open(path) as manifest_file:
+        content = manifest_file.read()
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ServError('PyYAML must be installed to load YAML manifests')
+        parse, errors = yaml.safe_load, yaml.YAMLError
+    else:
+        parse, errors = json.loads, ValueError
+    try:
+        manifest = parse(content)
+    except errors as ex:
+        raise ServError('Failed to parse manifest {0}: {1}'.format(path, ex))
+
+    if isinstance(manifest, dict):
+        manifest = manifest.get('services')
+    if not isinstance(manifest, list) or \
+            not all(isinstance(spec, dict) for spec in manifest):
+        raise ServError(
+            'Manifest {0} must contain a list of services'.format(path))
+    return manifest
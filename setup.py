@@ -1,6 +1,8 @@
 import os
+import sys
 import codecs
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 
 
 def read(*parts):
@@ -24,6 +26,20 @@ def _get_package_data():
     return [jn(x, d, f) for d in ls(b) if d in dr for f in ls(jn(b, d))]
 
 
+# Modules which use syntax only available in newer versions of Python
+# and are therefore not installed on older ones.
+PY35_MODULES = ('async_serv',)
+
+
+class BuildPy(build_py):
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 5):
+            modules = [(pkg, module, path) for pkg, module, path in modules
+                       if not (pkg == 'serv' and module in PY35_MODULES)]
+        return modules
+
+
 IS_WIN = (os.name == 'nt')
 install_requires = [
     "click==6.6",
@@ -48,12 +64,17 @@ setup(
     long_description=read('README.rst'),
     packages=find_packages(exclude=[]),
     package_data={'serv': _get_package_data()},
+    cmdclass={'build_py': BuildPy},
     entry_points={
         'console_scripts': [
             'serv = serv.serv:main',
         ]
     },
     install_requires=install_requires,
+    extras_require={
+        # Required for loading YAML manifests using `serv apply`
+        'yaml': ['PyYAML'],
+    },
     classifiers=[
         'Programming Language :: Python',
         'Programming Language :: Python :: 2.6',
@@ -43,17 +43,28 @@ class MockSystem(Base):
         if os.path.isfile(self.started_file):
             os.remove(self.started_file)
 
+    def get_command(self, action):
+        if action == 'start':
+            return ['cp', self.svc_file_dest, self.started_file]
+        elif action == 'stop':
+            return ['rm', '-f', self.started_file]
+
+    def reload(self):
+        shutil.copy2(self.svc_file_dest, self.svc_file_dest + '.reloaded')
+
     def uninstall(self):
         if os.path.isfile(self.svc_file_dest):
             os.remove(self.svc_file_dest)
 
-    def status(self, name=''):
+    def status(self, name='', names=None):
         super(MockSystem, self).status(name=name)
         self.services.update(services=[])
-        self.services['services'].append(dict(
-            started=os.path.isfile(self.started_file),
-            installed=os.path.isfile(self.svc_file_dest),
-            name=name))
+        for service in [n for n in [name] + list(names or []) if n]:
+            svc_file_dest = os.path.join(MOCK_INIT_SYSTEM_DIR, service)
+            self.services['services'].append(dict(
+                started=os.path.isfile(svc_file_dest + '.started'),
+                installed=os.path.isfile(svc_file_dest),
+                name=service))
         return self.services
 
     @staticmethod
@@ -63,6 +74,9 @@ class MockSystem(Base):
     def is_service_exists(self):
         return os.path.isfile(self.svc_file_dest)
 
+    def is_running(self):
+        return os.path.isfile(self.started_file)
+
     def validate_platform(self):
         if utils.IS_WIN or utils.IS_DARWIN:
             raise ServError(
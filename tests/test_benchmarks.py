@@ -0,0 +1,227 @@
+"""Benchmarks for the hot paths of serv.
+
+These are not run as part of the test suite. Run them using
+`tox -e benchmark` which compares the results against the committed
+baseline and fails if the mean of any of them got more than 25% slower
+(see the `benchmark` env in tox.ini).
+"""
+import os
+import sys
+import shutil
+import fnmatch
+import subprocess
+from distutils.spawn import find_executable
+
+import mock
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import serv.serv as serv  # NOQA
+from serv.init import base  # NOQA
+from serv.init import sysv  # NOQA
+from serv.init import upstart  # NOQA
+from serv.init import systemd  # NOQA
+
+from . import mock_system  # NOQA
+
+
+TEMPLATES = (
+    'systemd.service',
+    'systemd',
+    'sysv',
+    'sysv.defaults',
+    'upstart.conf',
+    'nssm.bat',
+)
+
+SERVICE_COUNTS = (1, 100, 10000)
+
+
+def _get_params(init_system, count):
+    return [base.Base(
+        init_sys=init_system,
+        cmd='/usr/bin/python',
+        name='service{0}'.format(i),
+        args='-m SimpleHTTPServer',
+        env=dict(key='value'),
+        nice=5,
+        limit_open_files=1024).params for i in range(count)]
+
+
+def _run(benchmark, func, *args):
+    # Large inputs take long enough for a handful of rounds to be
+    # representative and calibrating them would take too long.
+    return benchmark.pedantic(func, args=args, rounds=5, warmup_rounds=1)
+
+
+class TestRender:
+    @pytest.mark.parametrize('count', SERVICE_COUNTS)
+    @pytest.mark.parametrize('template', TEMPLATES)
+    def test_render(self, benchmark, template, count):
+        services = _get_params(template.split('.')[0], count)
+        env = base.get_template_environment()
+
+        def render():
+            for params in services:
+                env.get_template(template).render(params)
+
+        _run(benchmark, render)
+
+    @pytest.mark.parametrize('count', SERVICE_COUNTS)
+    def test_render_cached(self, benchmark, tmpdir, count):
+        services = [base.Base(logger=serv.logger, **params)
+                    for params in _get_params('systemd', count)]
+
+        def render():
+            for init in services:
+                init._render('systemd.service')
+
+        with mock.patch.dict(os.environ, {'SERV_CACHE_DIR': str(tmpdir),
+                                          'SERV_RENDER_CACHE': '1'}):
+            render()
+            _run(benchmark, render)
+
+
+class TestSystemDStatus:
+    units = 10000
+
+    @pytest.fixture
+    def show_output(self):
+        """Return the output of `systemctl show` for each unit.
+        """
+        return [[
+            'Id=service{0}.service\n'.format(i),
+            'Description=Service number {0}\n'.format(i),
+            'LoadState=loaded\n',
+            'ActiveState=active\n',
+            'SubState=running\n',
+            'MainPID={0}\n'.format(i + 1000),
+            'MemoryCurrent=1048576\n',
+            'CPUUsageNSec=1500000000\n',
+            'ActiveEnterTimestampMonotonic=1000000\n',
+            'NRestarts=0\n',
+            '\n',
+        ] for i in range(self.units)]
+
+    def test_parse_show_output(self, benchmark, show_output):
+        lines = [line for unit in show_output for line in unit]
+
+        def parse():
+            return list(systemd.SystemD._parse_show_output(lines))
+
+        assert len(_run(benchmark, parse)) == self.units
+
+    @pytest.mark.parametrize('name', ('', 'service5000', 'service1*'))
+    def test_status(self, benchmark, show_output, name):
+        # Like systemctl, only show the units matching the pattern.
+        pattern = systemd._get_unit_name(name or '*')
+        units = [unit for unit in show_output
+                 if fnmatch.fnmatch(unit[0][3:-1], pattern)]
+        lines = [line for unit in units for line in unit]
+
+        init = systemd.SystemD(init_sys='systemd')
+        with mock.patch.object(systemd, 'sh') as sh:
+            sh.systemctl.side_effect = lambda *args, **kwargs: iter(lines)
+            result = _run(benchmark, init.status, name)
+        assert len(result['services']) == len(units)
+
+
+class TestUpstartStatus:
+    jobs = 10000
+
+    @pytest.mark.parametrize('name', ('', 'service5000', 'service1*'))
+    def test_status(self, benchmark, name):
+        lines = ['service{0} start/running, process {1}\n'.format(i, i + 1000)
+                 for i in range(self.jobs)]
+        init = upstart.Upstart(init_sys='upstart')
+        with mock.patch.object(upstart, 'sh') as sh:
+            sh.initctl.side_effect = lambda *args, **kwargs: iter(lines)
+            result = _run(benchmark, init.status, name)
+        assert result['services']
+
+
+class TestSysVStatus:
+    scripts = 200
+
+    def test_status(self, benchmark, tmpdir):
+        init_d = tmpdir.mkdir('init.d')
+        run = tmpdir.mkdir('run')
+        for i in range(self.scripts):
+            name = 'service{0}'.format(i)
+            init_d.join(name).write(
+                '#!/bin/sh\n'
+                '# Description:       {0}\n'
+                'program={1}\n'.format(name, sys.executable))
+            # Half of the services are running.
+            if i % 2:
+                run.join(name + '.pid').write(str(os.getpid()))
+
+        init = sysv.SysV(init_sys='sysv')
+        with mock.patch.multiple('serv.constants',
+                                 SYSV_SVC_PATH=str(init_d),
+                                 SYSV_PID_PATH=str(run)):
+            result = _run(benchmark, init.status)
+        assert len(result['services']) == self.scripts
+
+
+class TestLookupInitSystems:
+    def test_detect(self, benchmark):
+        client = serv.Serv('systemd', cache_init_system=False)
+        benchmark(client.lookup_init_systems)
+
+    def test_cached(self, benchmark, tmpdir):
+        client = serv.Serv('systemd')
+        with mock.patch.dict(os.environ, {'SERV_CACHE_DIR': str(tmpdir)}):
+            # Only measure reading the cache from disk, not the in-process
+            # memoization of the detected init systems.
+            with mock.patch.object(serv, '_detected_init_systems', []):
+                client.lookup_init_systems()
+
+            def lookup():
+                del serv._detected_init_systems[:]
+                return client.lookup_init_systems()
+
+            with mock.patch.object(serv, '_detected_init_systems', []):
+                benchmark(lookup)
+
+
+class TestCLIStartup:
+    @pytest.mark.parametrize('args', (
+        ['--help'],
+        ['stop', 'testservice', '--init-system', 'sysv']))
+    def test_cold_start(self, benchmark, args):
+        code = 'from serv.serv import main\nmain({0!r})'.format(args)
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        def start():
+            subprocess.call(
+                [sys.executable, '-c', code],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=cwd)
+
+        _run(benchmark, start)
+
+
+class TestApplyMock:
+    serv.INIT_SYSTEM_MAPPING['mock'] = mock_system.MockSystem
+
+    @pytest.mark.parametrize('count', (1, 100))
+    def test_apply(self, benchmark, count):
+        executable = find_executable('python') or '/usr/bin/python2'
+        specs = [dict(cmd=executable, name='service{0}'.format(i))
+                 for i in range(count)]
+        client = serv.Serv('mock')
+
+        def setup():
+            shutil.rmtree(
+                mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
+            return (specs, ), dict(overwrite=True, deploy=True, start=True)
+
+        try:
+            results = benchmark.pedantic(client.apply, setup=setup, rounds=5)
+        finally:
+            shutil.rmtree(
+                mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
+        assert not [r for r in results if r['error']]
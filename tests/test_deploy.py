@@ -6,8 +6,10 @@ from distutils.spawn import find_executable
 
 import pytest
 
-from serv import init
 from serv import utils
+from serv.init import sysv
+from serv.init import upstart
+from serv.init import systemd
 
 from .test_serv import _invoke
 
@@ -68,21 +70,21 @@ class TestDeployReal:
                 ignore_errors=True)
 
     @pytest.mark.skipif(
-        not init.systemd.is_system_exists(),
+        not systemd.is_system_exists(),
         reason='Systemd not found on this system.')
     @pytest.mark.skipif(utils.IS_WIN, reason='Irrelevant on Windows')
     def test_systemd(self):
         self._test_deploy_remove('systemd')
 
     @pytest.mark.skipif(
-        not init.upstart.is_system_exists(),
+        not upstart.is_system_exists(),
         reason='Upstart not found on this system.')
     @pytest.mark.skipif(utils.IS_WIN, reason='Irrelevant on Windows')
     def test_upstart(self):
         self._test_deploy_remove('upstart')
 
     @pytest.mark.skipif(
-        not init.sysv.is_system_exists(),
+        not sysv.is_system_exists(),
         reason='SysV not found on this system.')
     @pytest.mark.skipif(utils.IS_WIN, reason='Irrelevant on Windows')
     def test_sysv(self):
@@ -1,6 +1,10 @@
 import os
+import sys
+import json
 import shlex
 import shutil
+import itertools
+import subprocess
 from distutils.spawn import find_executable
 
 try:
@@ -12,8 +16,13 @@ import pytest
 import click.testing as clicktest
 
 import serv.serv as serv
+from serv import cache
+from serv import probes
 from serv import utils
+from serv import constants
 from serv import exceptions
+from serv import profiling
+from serv.init import base
 
 # TODO: Consolidate all find_executable's
 
@@ -32,6 +41,23 @@ def _invoke(command):
     return cli.invoke(getattr(serv, func), params)
 
 
+def _run_cli(args, setup=''):
+    """Run the CLI in a separate process and return its stdout.
+
+    Unlike `_invoke`, this captures everything written to the process's
+    stdout, including logs. `setup` is code to run before the CLI.
+    """
+    code = '{0}\nfrom serv.serv import main\nmain({1!r})'.format(setup, args)
+    proc = subprocess.Popen(
+        [sys.executable, '-c', code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    out, err = proc.communicate()
+    assert proc.returncode == 0, err
+    return out.decode('utf-8')
+
+
 class TestGeneral:
     @pytest.mark.skipif(utils.IS_WIN, reason='Irrelevant on Windows')
     def test_utils_run(self):
@@ -104,6 +130,39 @@ class TestGeneral:
             assert available_init_systems.sort() == \
                 ['systemd', 'sysv', 'upstart'].sort()
 
+    @mock.patch.object(serv, '_detected_init_systems', [])
+    def test_init_systems_lookup_cache(self, tmpdir):
+        with mock.patch.dict(os.environ, {'SERV_CACHE_DIR': str(tmpdir)}):
+            with mock.patch.object(serv.Serv, '_detect_init_systems') as _d:
+                _d.return_value = ['upstart']
+                assert serv.Serv().init_system == 'upstart'
+                assert serv.Serv().init_system == 'upstart'
+                assert _d.call_count == 1
+                # Only the on-disk cache remains
+                del serv._detected_init_systems[:]
+                assert serv.Serv().init_system == 'upstart'
+                assert _d.call_count == 1
+                del serv._detected_init_systems[:]
+                with mock.patch.object(
+                        serv.Serv, '_get_init_system_cache_key') as _key:
+                    _key.return_value = ['changed']
+                    _d.return_value = ['sysv']
+                    assert serv.Serv().init_system == 'sysv'
+                assert _d.call_count == 2
+            assert tmpdir.join('init-system.json').check()
+
+    @mock.patch.object(serv, '_detected_init_systems', [])
+    def test_init_systems_lookup_cache_disabled(self, tmpdir):
+        with mock.patch.dict(os.environ, {'SERV_CACHE_DIR': str(tmpdir)}):
+            with mock.patch.object(serv.Serv, '_detect_init_systems') as _d:
+                _d.return_value = ['upstart']
+                serv.Serv(cache_init_system=False)
+                with mock.patch.dict(
+                        os.environ, {'SERV_DISABLE_INIT_SYSTEM_CACHE': '1'}):
+                    serv.Serv()
+                assert _d.call_count == 2
+        assert not tmpdir.listdir()
+
     def _test_static_os_specific_init_systems(self, expected_systems):
         client = serv.Serv()
         available_init_systems = client.lookup_init_systems()
@@ -122,6 +181,539 @@ class TestGeneral:
             available_init_systems = client.lookup_init_systems()
             assert available_init_systems == ['launchd']
 
+    def test_wait_for(self):
+        calls = []
+        with mock.patch('time.sleep') as sleep:
+            assert utils.wait_for(lambda: calls.append(1) or len(calls) == 4,
+                                  timeout=10, interval=0.1, max_interval=0.3)
+        assert [c[0][0] for c in sleep.call_args_list] == [0.1, 0.2, 0.3]
+
+    def test_wait_for_timeout(self):
+        assert not utils.wait_for(lambda: False, timeout=0.1)
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_is_running(self, sh):
+        init = serv.Serv('systemd')._get_implementation('x')
+        sh.systemctl.return_value = 'ActiveState=deactivating\n'
+        assert init.is_running()
+        sh.systemctl.return_value = 'ActiveState=inactive\n'
+        assert not init.is_running()
+        sh.systemctl.assert_called_with('show', 'x', property='ActiveState')
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_native_restart_and_reload(self, sh):
+        init = serv.Serv('systemd')._get_implementation('x')
+        init.restart()
+        init.reload()
+        assert sh.systemctl.call_args_list == [
+            mock.call('restart', 'x'), mock.call('reload', 'x')]
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_status(self, sh):
+        sh.systemctl.return_value = iter([
+            'Id=a.service\n',
+            'Description=A service with a long description\n',
+            'LoadState=loaded\n',
+            'ActiveState=active\n',
+            'SubState=running\n',
+            'MainPID=1234\n',
+            'MemoryCurrent=1048576\n',
+            'CPUUsageNSec=1500000000\n',
+            'ActiveEnterTimestampMonotonic=1000000\n',
+            'NRestarts=2\n',
+            '\n',
+            'Id=web-1.service\n',
+            'LoadState=loaded\n',
+            'ActiveState=inactive\n',
+            'SubState=dead\n',
+            'MainPID=0\n',
+            'MemoryCurrent=[not set]\n',
+            'CPUUsageNSec=18446744073709551615\n',
+            'ActiveEnterTimestampMonotonic=0\n',
+        ])
+        init = serv.Serv('systemd')._get_implementation('')
+        services = init.status(names=['a', 'web-*'])['services']
+        sh.systemctl.assert_called_once_with(
+            'show',
+            '--property=Id,Description,LoadState,ActiveState,SubState,'
+            'MainPID,MemoryCurrent,CPUUsageNSec,'
+            'ActiveEnterTimestampMonotonic,NRestarts',
+            'a.service',
+            'web-*.service',
+            _iter=True)
+        assert len(services) == 2
+        assert services[0]['uptime'] > 0
+        del services[0]['uptime']
+        assert services[0] == dict(
+            name='a.service',
+            description='A service with a long description',
+            load='loaded',
+            active='active',
+            sub='running',
+            pid=1234,
+            memory=1048576,
+            cpu_time=1.5,
+            restarts=2)
+        assert services[1] == dict(
+            name='web-1.service',
+            description=None,
+            load='loaded',
+            active='inactive',
+            sub='dead',
+            pid=None,
+            memory=None,
+            cpu_time=None,
+            uptime=None,
+            restarts=None)
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_list_services(self, sh):
+        sh.systemctl.return_value = iter([
+            'Id=web-2.service\n', 'LoadState=loaded\n', '\n',
+            'Id=web-1.service\n', 'LoadState=loaded\n', '\n',
+            'Id=web-3.service\n', 'LoadState=not-found\n',
+        ])
+        init = serv.Serv('systemd')._get_implementation('')
+        assert init.list_services('web-*') == ['web-1', 'web-2']
+        assert 'web-*.service' in sh.systemctl.call_args[0]
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_status_ndjson(self, sh):
+        def systemctl():
+            yield 'Id=a.service\n'
+            yield '\n'
+            yield 'Id=b.service\n'
+
+        sh.systemctl.side_effect = lambda *args, **kwargs: systemctl()
+        result = _invoke('status --format ndjson --init-system systemd')
+        assert result.exit_code == 0
+        lines = result.output.strip().splitlines()
+        assert [json.loads(line)['name'] for line in lines] == \
+            ['a.service', 'b.service']
+        assert '*.service' in sh.systemctl.call_args[0]
+
+    def test_status_ndjson_stdout(self, tmpdir):
+        init_d = tmpdir.mkdir('init.d')
+        init_d.join('a').write('#!/bin/sh\nprogram={0}\n'.format(
+            sys.executable))
+        setup = ('import serv.constants as c\n'
+                 'c.SYSV_SVC_PATH = {0!r}\n'
+                 'c.SYSV_PID_PATH = {1!r}').format(
+                     str(init_d), str(tmpdir.mkdir('run')))
+        out = _run_cli(['status', '--format', 'ndjson',
+                        '--init-system', 'sysv'], setup)
+        # Every line must be a JSON record and not, for instance, a log.
+        assert [json.loads(line)['name'] for line in out.splitlines()] == \
+            ['a']
+
+    def test_sysv_status(self, tmpdir):
+        init_d = tmpdir.mkdir('init.d')
+        run = tmpdir.mkdir('run')
+        for name, program in (('running', sys.executable),
+                              ('reused', '/usr/bin/other'),
+                              ('stale', sys.executable),
+                              ('stopped', sys.executable)):
+            init_d.join(name).write(
+                '#!/bin/sh\n'
+                '# Description:       {0} service\n'
+                'program={1}\n'.format(name, program))
+        run.join('running.pid').write(str(os.getpid()))
+        run.join('reused.pid').write(str(os.getpid()))
+        run.join('stale.pid').write('999999999')
+
+        init = serv.Serv('sysv')._get_implementation('')
+        with mock.patch.multiple('serv.constants',
+                                 SYSV_SVC_PATH=str(init_d),
+                                 SYSV_PID_PATH=str(run)):
+            # Retrieving statuses mustn't run any commands.
+            with mock.patch('subprocess.Popen', side_effect=AssertionError):
+                with mock.patch('os.fork', side_effect=AssertionError):
+                    statuses = init.status()['services']
+            assert [s['name'] for s in init.status(
+                names=['st*', 'missing'])['services']] == \
+                ['missing', 'stale', 'stopped']
+        statuses = dict((s['name'], s) for s in statuses)
+        assert sorted(statuses) == ['reused', 'running', 'stale', 'stopped']
+        running = statuses['running']
+        assert running['active'] == 'active'
+        assert running['description'] == 'running service'
+        assert running['pid'] == os.getpid()
+        assert running['memory'] > 0
+        assert running['cpu_time'] > 0
+        assert running['uptime'] >= 0
+        assert statuses['reused']['active'] == 'failed'
+        assert statuses['stale']['active'] == 'failed'
+        assert statuses['stopped']['active'] == 'inactive'
+        assert statuses['stopped']['pid'] is None
+
+    @mock.patch('serv.init.upstart.sh')
+    def test_upstart_status(self, sh):
+        sh.initctl.return_value = iter([
+            'ssh start/running, process 1234\n',
+            'rc stop/waiting\n',
+            'network-interface (eth0) start/running\n',
+            'cron start/pre-start, (pre-start) process 1345\n',
+            '\tpre-start process 1345\n',
+            'tty1 stop/stopping\n',
+        ])
+        init = serv.Serv('upstart')._get_implementation('')
+        statuses = init.status()['services']
+        sh.initctl.assert_called_once_with('list', _iter=True)
+        assert [(s['name'], s['active'], s['sub'], s['pid'])
+                for s in statuses] == [
+            ('ssh', 'active', 'running', 1234),
+            ('rc', 'inactive', 'waiting', None),
+            ('network-interface (eth0)', 'active', 'running', None),
+            ('cron', 'activating', 'pre-start', 1345),
+            ('tty1', 'deactivating', 'stopping', None)]
+        assert set(statuses[0]) == set(base.STATUS_FIELDS)
+
+        sh.initctl.return_value = iter([
+            'ssh start/running, process 1234\n',
+            'network-interface (eth0) start/running\n'])
+        statuses = init.status(names=['network-*', 'missing'])['services']
+        assert [(s['name'], s['load']) for s in statuses] == [
+            ('network-interface (eth0)', 'loaded'), ('missing', 'not-found')]
+
+    def _test_systemd_stats(self, cgroup, files):
+        for path, content in files.items():
+            cgroup.join(path).write(content, ensure=True)
+        init = serv.Serv('systemd')._get_implementation('')
+        with mock.patch('serv.constants.CGROUP_PATH', str(cgroup)):
+            with mock.patch('serv.init.systemd.sh') as sh:
+                stats = init.stats(names=['a*', 'missing'])['services']
+        assert not sh.mock_calls
+        assert [s['name'] for s in stats] == ['a.service', 'missing.service']
+        assert stats[1] == dict(
+            base.Base._create_stats(), name='missing.service')
+        return stats[0]
+
+    def test_systemd_stats_cgroup_v2(self, tmpdir):
+        stats = self._test_systemd_stats(tmpdir, {
+            'cgroup.controllers': 'cpu io memory pids',
+            'system.slice/a.service/memory.current': '1048576\n',
+            'system.slice/a.service/pids.current': '3\n',
+            'system.slice/a.service/cpu.stat':
+                'usage_usec 1500000\nuser_usec 1000000\n'
+                'system_usec 500000\n',
+            'system.slice/a.service/io.stat':
+                '8:0 rbytes=1024 wbytes=2048 rios=1 wios=2\n'
+                '8:16 rbytes=1024 wbytes=0 rios=1 wios=0\n',
+            'system.slice/b.service/memory.current': '1\n',
+        })
+        assert stats == dict(
+            name='a.service',
+            memory=1048576,
+            tasks=3,
+            cpu_time=1.5,
+            cpu_user_time=1.0,
+            cpu_system_time=0.5,
+            io_read_bytes=2048,
+            io_write_bytes=2048)
+
+    def test_systemd_stats_cgroup_v1(self, tmpdir):
+        clock_ticks = os.sysconf('SC_CLK_TCK')
+        stats = self._test_systemd_stats(tmpdir, {
+            'systemd/system.slice/a.service/tasks': '',
+            'memory/system.slice/a.service/memory.usage_in_bytes': '1024\n',
+            'pids/system.slice/a.service/pids.current': '2\n',
+            'cpuacct/system.slice/a.service/cpuacct.usage': '2000000000\n',
+            'cpuacct/system.slice/a.service/cpuacct.stat':
+                'user {0}\nsystem {0}\n'.format(clock_ticks),
+            'blkio/system.slice/a.service/blkio.throttle.io_service_bytes':
+                '8:0 Read 4096\n8:0 Write 1024\n8:0 Total 5120\n'
+                'Total 5120\n',
+        })
+        assert stats == dict(
+            name='a.service',
+            memory=1024,
+            tasks=2,
+            cpu_time=2.0,
+            cpu_user_time=1.0,
+            cpu_system_time=1.0,
+            io_read_bytes=4096,
+            io_write_bytes=1024)
+
+    def test_stats_not_supported(self):
+        result = _invoke('stats --init-system upstart')
+        assert result.exit_code == 1
+        assert 'upstart does not support retrieving stats' in result.output
+
+    @mock.patch('time.sleep')
+    def test_watch_polling(self, _):
+        def status(name, state):
+            return base.Base._create_status(
+                name=name, load='loaded', active=state)
+
+        init = serv.Serv('upstart')._get_implementation('')
+        with mock.patch.object(init, 'status_iter', side_effect=[
+                [status('a', 'active')],
+                [status('a', 'active')],
+                [status('a', 'inactive'), status('b', 'active')],
+                []]) as status_iter:
+            events = list(itertools.islice(init.watch('', ['a', 'b']), 4))
+        status_iter.assert_called_with('', ['a', 'b'])
+        assert [(e['name'], e['active'], e['previous'] and
+                 e['previous']['active']) for e in events] == [
+            ('a', 'inactive', 'active'),
+            ('b', 'active', None),
+            ('a', 'inactive', 'inactive'),
+            ('b', 'inactive', 'active')]
+        assert events[2]['load'] == 'not-found'
+        assert all(isinstance(e['time'], float) for e in events)
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_watch(self, sh):
+        import sh as real_sh
+
+        journal = mock.MagicMock()
+        journal.__iter__.return_value = iter([
+            json.dumps(dict(UNIT='a.service', MESSAGE='Starting a...')),
+            json.dumps(dict(UNIT='b.service', MESSAGE='Starting b...')),
+            'not json',
+            json.dumps(dict(MESSAGE='Reloading.')),
+            json.dumps(dict(UNIT='a.service', MESSAGE='Started a.')),
+            json.dumps(dict(UNIT='a.service', MESSAGE='Stopped a.')),
+        ])
+        sh.ErrorReturnCode = real_sh.ErrorReturnCode
+        sh.journalctl.side_effect = [
+            json.dumps(dict(MESSAGE='Reached target Multi-User System.')),
+            journal]
+        states = iter(['inactive', 'active', 'active', 'inactive'])
+
+        def systemctl(*args, **kwargs):
+            return iter(['Id=a.service\n',
+                         'ActiveState={0}\n'.format(next(states))])
+
+        sh.systemctl.side_effect = systemctl
+        init = serv.Serv('systemd')._get_implementation('')
+        events = init.watch('a')
+        assert [e['active'] for e in itertools.islice(events, 2)] == \
+            ['active', 'inactive']
+        events.close()
+        sh.journalctl.assert_called_with(
+            '--follow', '--output=json', '--lines=0', '_PID=1', _iter=True)
+        journal.terminate.assert_called_once_with()
+        assert sh.systemctl.call_args[0][-1] == 'a.service'
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_watch_journal_unreadable(self, sh):
+        # Users who can't read the system journal get no messages.
+        sh.journalctl.return_value = ''
+        init = serv.Serv('systemd')._get_implementation('')
+        with mock.patch.object(base.Base, 'watch',
+                               return_value=iter([dict(name='a')])) as watch:
+            assert list(init.watch('a', interval=2)) == [dict(name='a')]
+        watch.assert_called_once_with('a', None, 2)
+        sh.journalctl.assert_called_once_with(
+            '--lines=1', '--output=json', '--quiet', '_PID=1')
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_watch_journal_error(self, sh):
+        import sh as real_sh
+
+        journal = mock.MagicMock()
+        journal.__iter__.side_effect = real_sh.ErrorReturnCode_1(
+            'journalctl', b'', b'Failed to follow the journal')
+        sh.ErrorReturnCode = real_sh.ErrorReturnCode
+        sh.journalctl.side_effect = [json.dumps(dict(MESSAGE='x')), journal]
+        sh.systemctl.return_value = iter([])
+        init = serv.Serv('systemd')._get_implementation('')
+        with pytest.raises(exceptions.ServError) as ex:
+            list(init.watch('a'))
+        assert 'Failed to watch services: Failed to follow the journal' in \
+            str(ex)
+
+    def test_watch_cli(self):
+        events = [dict(name='a', active='active'),
+                  dict(name='b', active='inactive')]
+
+        def watch(*args, **kwargs):
+            for event in events:
+                yield event
+            raise KeyboardInterrupt
+
+        with mock.patch.object(serv.Serv, 'watch', side_effect=watch) as w:
+            result = _invoke('watch a b --interval 2 --init-system upstart')
+        assert result.exit_code == 0
+        w.assert_called_once_with('', names=['a', 'b'], interval=2.0)
+        assert [json.loads(line) for line in
+                result.output.strip().splitlines()] == events
+
+    def test_watch_cli_stdout(self):
+        setup = ('from serv.init import sysv\n'
+                 'sysv.SysV.watch = lambda self, *args, **kwargs: iter(['
+                 'dict(name="a", active="active")])')
+        out = _run_cli(['watch', '--init-system', 'sysv'], setup)
+        # Logs mustn't be printed along with the events.
+        assert [json.loads(line) for line in out.splitlines()] == \
+            [dict(name='a', active='active')]
+
+    def test_systemd_template_unit(self):
+        client = serv.Serv('systemd')
+        try:
+            files = client.generate(
+                sys.executable, 'worker@', overwrite=True,
+                args='--id %i', var=['WORKER_ID=w-%i', 'KEY=value'])
+            assert [os.path.basename(f) for f in files] == ['worker@.service']
+            with open(files[0]) as f:
+                content = f.read()
+        finally:
+            shutil.rmtree(utils.get_tmp_dir('systemd', 'worker@'),
+                          ignore_errors=True)
+        assert 'ExecStart={0} --id %i\n'.format(sys.executable) in content
+        assert 'Environment="WORKER_ID=w-%i"\n' in content
+        assert 'Environment="KEY=value"\n' in content
+        assert 'EnvironmentFile' not in content
+
+        init = client._get_implementation('worker@')
+        with pytest.raises(exceptions.ServError) as ex:
+            init.start()
+        assert 'worker@ is a template unit' in str(ex)
+
+    @mock.patch('multiprocessing.cpu_count', return_value=2)
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_scale(self, sh, _, tmpdir):
+        def show(*args, **kwargs):
+            return iter([
+                'Id=worker@1.service\n', 'ActiveState=active\n', '\n',
+                'Id=worker@2.service\n', 'ActiveState=activating\n', '\n',
+                'Id=worker@3.service\n', 'ActiveState=inactive\n', '\n',
+                'Id=worker@5.service\n', 'ActiveState=active\n', '\n',
+                'Id=worker@6.service\n', 'LoadState=loaded\n',
+                'ActiveState=failed\n', '\n',
+                'Id=worker@7.service\n', 'LoadState=not-found\n',
+                'ActiveState=inactive\n', '\n',
+            ])
+
+        def read_drop_in(unit):
+            path = tmpdir.join(
+                unit + '.service.d', 'serv-cpu-affinity.conf')
+            return path.read() if path.check() else None
+
+        sh.systemctl.side_effect = show
+        init = serv.Serv('systemd')._get_implementation('worker@')
+        with mock.patch('serv.constants.SYSTEMD_DROP_IN_PATH', str(tmpdir)):
+            result = init.scale(3, pin_cpus=True)
+            assert result == dict(
+                instances=['worker@1', 'worker@2', 'worker@3'],
+                started=['worker@3'],
+                stopped=['worker@5', 'worker@6'])
+            assert sh.systemctl.call_args_list[1:] == [
+                mock.call('daemon-reload'),
+                mock.call('stop', 'worker@5', 'worker@6'),
+                mock.call('disable', 'worker@5', 'worker@6'),
+                mock.call('enable', 'worker@3'),
+                mock.call('start', 'worker@3')]
+            assert [read_drop_in('worker@{0}'.format(i)) for i in (1, 2, 3)] \
+                == ['[Service]\nCPUAffinity={0}\n'.format(cpu)
+                    for cpu in (0, 1, 0)]
+            assert read_drop_in('worker@5') is None
+
+            # Unpinning removes the drop-ins.
+            sh.systemctl.reset_mock()
+            init.scale(3)
+            assert not tmpdir.listdir()
+            assert mock.call('daemon-reload') in sh.systemctl.call_args_list
+
+    def test_scale_not_supported(self):
+        with mock.patch('serv.init.upstart.Upstart.is_service_exists',
+                        return_value=True):
+            result = _invoke('scale worker 2 --init-system upstart')
+        assert result.exit_code == 1
+        assert 'upstart does not support scaling services' in result.output
+
+    def _get_systemd_install(self, tmpdir, content):
+        init = serv.Serv('systemd')._get_implementation('x')
+        init.cmd = sys.executable
+        init.overwrite = False
+        init.svc_file_path = str(tmpdir.join('generated.service'))
+        init.env_file_path = str(tmpdir.join('generated'))
+        init.svc_file_dest = str(tmpdir.join('x.service'))
+        init.env_file_dest = str(tmpdir.join('x'))
+        for path in (init.svc_file_path, init.env_file_path,
+                     init.svc_file_dest, init.env_file_dest):
+            with open(path, 'w') as f:
+                f.write(content)
+        return init
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_install_unchanged(self, sh, tmpdir):
+        sh.systemctl.return_value = \
+            'LoadState=loaded\nUnitFileState=enabled\nNeedDaemonReload=no\n'
+        init = self._get_systemd_install(tmpdir, 'content')
+        init.install()
+        sh.systemctl.assert_called_once_with(
+            'show', 'x', property='LoadState,UnitFileState,NeedDaemonReload')
+        assert init.file_states == {
+            init.svc_file_dest: 'unchanged', init.env_file_dest: 'unchanged'}
+        assert not os.path.isfile(init.svc_file_path)
+        assert not os.path.isfile(init.env_file_path)
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_install_unchanged_not_enabled(self, sh, tmpdir):
+        # e.g. a previous deployment failed after deploying the files.
+        sh.systemctl.return_value = \
+            'LoadState=loaded\nUnitFileState=disabled\nNeedDaemonReload=no\n'
+        init = self._get_systemd_install(tmpdir, 'content')
+        init.install()
+        assert sh.systemctl.call_args_list[1:] == [
+            mock.call('enable', 'x'), mock.call('daemon-reload')]
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_install_changed(self, sh, tmpdir):
+        init = self._get_systemd_install(tmpdir, 'content')
+        with open(init.svc_file_path, 'w') as f:
+            f.write('new content')
+        with pytest.raises(exceptions.ServError) as ex:
+            init.install()
+        assert 'File already exists: {0}'.format(init.svc_file_dest) in \
+            str(ex)
+
+        init.overwrite = True
+        init.install()
+        assert sh.systemctl.call_args_list == [
+            mock.call('enable', 'x'), mock.call('daemon-reload')]
+        assert init.file_states == {
+            init.svc_file_dest: 'updated', init.env_file_dest: 'unchanged'}
+        assert tmpdir.join('x.service').read() == 'new content'
+
+    def test_dependency_waves(self):
+        waves = utils.get_dependency_waves(dict(
+            web=set(['db', 'cache']),
+            worker=set(['db', 'queue']),
+            db=set(),
+            cache=set(['external']),
+            queue=set(),
+            proxy=set(['web'])))
+        assert waves == [
+            ['cache', 'db', 'queue'], ['web', 'worker'], ['proxy']]
+
+    def test_dependency_waves_cycle(self):
+        with pytest.raises(exceptions.ServError) as ex:
+            utils.get_dependency_waves(dict(
+                a=set(['c']), b=set(['a']), c=set(['b']), d=set()))
+        assert 'circular dependencies: a, b, c' in str(ex)
+
+    def test_load_manifest(self, tmpdir):
+        services = [dict(cmd='/usr/bin/python2', name='x'), dict(cmd='y')]
+        json_manifest = tmpdir.join('manifest.json')
+        json_manifest.write(json.dumps(services))
+        assert utils.load_manifest(str(json_manifest)) == services
+        yaml_manifest = tmpdir.join('manifest.yaml')
+        yaml_manifest.write('services:\n'
+                            '  - cmd: /usr/bin/python2\n'
+                            '    name: x\n'
+                            '  - cmd: y\n')
+        assert utils.load_manifest(str(yaml_manifest)) == services
+
+    def test_load_bad_manifest(self, tmpdir):
+        manifest = tmpdir.join('manifest.json')
+        manifest.write(json.dumps(dict(cmd='x')))
+        with pytest.raises(exceptions.ServError) as ex:
+            utils.load_manifest(str(manifest))
+        assert 'must contain a list of services' in str(ex)
+
     def test_bad_niceness_level(self):
         if utils.IS_WIN:
             cmd = find_executable('python') or 'c:\\python27\\python'
@@ -145,7 +737,7 @@ class TestGenerate:
         return os.path.join(
             utils.get_tmp_dir(system, self.service), getattr(self, system))
 
-    def _test_generate(self, system):
+    def _test_generate(self, system, extra_args=''):
         if system == 'nssm':
             self.cmd = find_executable('python') or 'c:\\python27\\python'
         else:
@@ -155,8 +747,8 @@ class TestGenerate:
         _invoke('generate {0} -n {1} -a "{2}" '
                 '-v --overwrite --init-system {3} '
                 '--nice=5 --limit-coredump=10 --limit-physical-memory=20 '
-                '--var=KEY1=VALUE1'.format(
-                    self.cmd, self.service, self.args, system))
+                '--var=KEY1=VALUE1 {4}'.format(
+                    self.cmd, self.service, self.args, system, extra_args))
         assert self.init_script
         with open(self.init_script) as generated_file:
             self.content = generated_file.read()
@@ -164,9 +756,11 @@ class TestGenerate:
     def test_systemd(self):
         try:
             self._test_generate('systemd')
+            assert self.content.startswith('[Unit]')
             assert self.cmd + ' ' + self.args in self.content
 
-            assert 'LimitNICE=5' in self.content
+            assert 'ExecReload=/bin/kill -HUP $MAINPID' in self.content
+            assert 'Nice=5' in self.content
             assert 'LimitCORE=10' in self.content
             assert 'LimitRSS=20' in self.content
             env_vars_file = os.path.join(
@@ -179,6 +773,153 @@ class TestGenerate:
                 os.path.dirname(self.init_script),
                 ignore_errors=True)
 
+    @pytest.mark.parametrize('system, expected', [
+        ('systemd', ['Requires=db.service queue.service\n',
+                     'After=db.service queue.service cache.service\n']),
+        ('upstart', ['start on (started db and started queue and '
+                     'started cache) and (filesystem or runlevel [2345])\n',
+                     'stop on stopping db or stopping queue or '
+                     'runlevel [!2345]\n']),
+        ('sysv', ['# Required-Start:    $remote_fs $syslog db queue\n',
+                  '# Should-Start:      cache\n']),
+    ])
+    def test_dependencies(self, system, expected):
+        try:
+            self._test_generate(
+                system, '--requires db --requires queue '
+                        '--after cache --after db')
+            for line in expected:
+                assert line in self.content
+        finally:
+            shutil.rmtree(
+                os.path.dirname(self.init_script),
+                ignore_errors=True)
+
+    @pytest.mark.parametrize('system, expected', [
+        ('systemd', ['CPUQuota=150%\n', 'CPUWeight=200\n',
+                     'MemoryHigh=512M\n', 'MemoryMax=1G\n',
+                     'TasksMax=infinity\n', 'IOWeight=50\n',
+                     'CPUAffinity=0-1,3\n', 'NUMAPolicy=bind\n',
+                     'NUMAMask=0\n']),
+        ('sysv', ['cgcreate -g "cpu,memory,pids,io:$cgroup"',
+                  'cgset -r cpu.max="150000 100000" "$cgroup"\n',
+                  'cgset -r memory.high="512M" "$cgroup"\n',
+                  'cgset -r pids.max="max" "$cgroup"\n',
+                  'cgset -r io.weight="default 50" "$cgroup"\n',
+                  'wrappers="$wrappers taskset -c 0-1,3"\n',
+                  'wrappers="$wrappers numactl --membind=0"\n',
+                  '$wrappers chroot --userspec']),
+    ])
+    def test_resource_controls(self, system, expected):
+        try:
+            self._test_generate(
+                system, '--cpu-quota 150 --cpu-weight 200 '
+                        '--memory-high 512M --memory-max 1G '
+                        '--tasks-max infinity --io-weight 50 '
+                        '--cpu-affinity "0-1 3" --numa-policy bind '
+                        '--numa-mask 0')
+            for line in expected:
+                assert line in self.content
+        finally:
+            shutil.rmtree(
+                os.path.dirname(self.init_script),
+                ignore_errors=True)
+
+    def test_unsupported_resource_controls(self):
+        init = serv.Serv('upstart')._get_implementation('a')
+        init.params.update(cpu_quota='50%', memory_max='1G')
+        init.logger = mock.Mock()
+        init._warn_about_unsupported_params()
+        init.logger.warning.assert_called_once_with(
+            '%s cannot apply %s. They will be ignored.',
+            'upstart', 'cpu_quota, memory_max')
+
+    @pytest.mark.parametrize('params, error', [
+        (dict(cpu_quota='0%'), '`cpu_quota` must be a percentage'),
+        (dict(cpu_weight=0), '`cpu_weight` must be an integer between'),
+        (dict(io_weight=10001), '`io_weight` must be an integer between'),
+        (dict(memory_max='1X'), '`memory_max` must be a size in bytes'),
+        (dict(tasks_max=-1), '`tasks_max` must be an integer greater'),
+        (dict(cpu_affinity='a'), '`cpu_affinity` must be a list of CPUs'),
+        (dict(numa_policy='x'), '`numa_policy` must be one of'),
+        (dict(numa_mask='0'), '`numa_mask` requires a `numa_policy`'),
+    ])
+    def test_bad_resource_controls(self, params, error):
+        with pytest.raises(exceptions.ServError) as ex:
+            base.Base(init_sys='systemd', name='a', **params)
+        assert error in str(ex)
+
+    @pytest.mark.parametrize('system, expected', [
+        ('systemd', ['CPUSchedulingPolicy=rr\n',
+                     'CPUSchedulingPriority=10\n',
+                     'IOSchedulingClass=best-effort\n',
+                     'IOSchedulingPriority=0\n',
+                     'OOMScoreAdjust=-500\n']),
+        ('sysv', ['wrappers="$wrappers chrt --rr 10"\n',
+                  'wrappers="$wrappers ionice -c 2 -n 0"\n',
+                  'echo -500 > /proc/$$/oom_score_adj']),
+        ('upstart', ['oom score -500\n']),
+    ])
+    def test_scheduling(self, system, expected):
+        try:
+            self._test_generate(
+                system, '--cpu-scheduling-policy rr '
+                        '--cpu-scheduling-priority 10 '
+                        '--io-scheduling-class best-effort '
+                        '--io-scheduling-priority 0 '
+                        '--oom-score-adjust=-500')
+            for line in expected:
+                assert line in self.content
+        finally:
+            shutil.rmtree(
+                os.path.dirname(self.init_script),
+                ignore_errors=True)
+
+    def test_scheduling_profile(self):
+        try:
+            # Explicitly provided params take precedence over the preset's.
+            self._test_generate(
+                'systemd', '--scheduling-profile background '
+                           '--oom-score-adjust 0')
+            for line in ('Nice=5\n', 'CPUSchedulingPolicy=idle\n',
+                         'IOSchedulingClass=idle\n', 'OOMScoreAdjust=0\n'):
+                assert line in self.content
+            assert 'IOSchedulingPriority' not in self.content
+        finally:
+            shutil.rmtree(
+                os.path.dirname(self.init_script),
+                ignore_errors=True)
+
+    @pytest.mark.parametrize('params, error', [
+        (dict(cpu_scheduling_policy='x'),
+         '`cpu_scheduling_policy` must be one of'),
+        (dict(cpu_scheduling_priority=10),
+         '`cpu_scheduling_priority` requires a `cpu_scheduling_policy`'),
+        (dict(cpu_scheduling_policy='fifo'),
+         'A `cpu_scheduling_policy` of fifo requires a '
+         '`cpu_scheduling_priority`'),
+        (dict(cpu_scheduling_policy='rr'),
+         'A `cpu_scheduling_policy` of rr requires a'),
+        (dict(cpu_scheduling_policy='fifo', cpu_scheduling_priority=100),
+         '`cpu_scheduling_priority` must be an integer between 1 and 99'),
+        (dict(io_scheduling_priority=8),
+         '`io_scheduling_priority` must be an integer between 0 and 7'),
+        (dict(io_scheduling_class='idle', io_scheduling_priority=0),
+         '`io_scheduling_priority` cannot be used with the idle'),
+        (dict(oom_score_adjust=-1001),
+         '`oom_score_adjust` must be an integer between -1000 and 1000'),
+        (dict(scheduling_profile='x'), 'Scheduling profile must be one of'),
+    ])
+    def test_bad_scheduling_params(self, params, error):
+        with pytest.raises(exceptions.ServError) as ex:
+            base.Base(init_sys='systemd', name='a', **params)
+        assert error in str(ex)
+
+    def test_depend_on_itself(self):
+        with pytest.raises(exceptions.ServError) as ex:
+            base.Base(init_sys='systemd', name='a', after=['a'])
+        assert 'Service a cannot depend on itself' in str(ex)
+
     def test_upstart(self):
         try:
             self._test_generate('upstart')
@@ -283,6 +1024,375 @@ class TestGenerate:
             shutil.rmtree(MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
 
 
+class TestTemplates:
+    def test_environment_is_shared(self):
+        env = base.get_template_environment()
+        assert env is base.get_template_environment()
+        assert env.get_template('systemd.service') is \
+            env.get_template('systemd.service')
+
+    def test_bytecode_cache(self, tmpdir):
+        cache_dir = str(tmpdir.join('cache'))
+        with mock.patch.object(base, '_template_environment', None):
+            with mock.patch.dict(
+                    os.environ, {'SERV_TEMPLATE_CACHE_DIR': cache_dir}):
+                env = base.get_template_environment()
+            env.get_template('upstart.conf')
+        assert len(os.listdir(cache_dir)) == 1
+
+
+class TestRenderCache:
+    @pytest.fixture(autouse=True)
+    def cache_dir(self, tmpdir):
+        with mock.patch.dict(os.environ, {'SERV_CACHE_DIR': str(tmpdir),
+                                          'SERV_RENDER_CACHE': '1'}):
+            yield tmpdir
+
+    def _get_implementation(self):
+        return serv.Serv('upstart')._create_implementation(
+            dict(init_sys='upstart', cmd='/usr/bin/x', name='x', env={}))
+
+    def test_render_cached(self):
+        init = self._get_implementation()
+        rendered = init._render('upstart.conf')
+        with mock.patch.object(base, 'get_template_environment') as env:
+            env.return_value.get_template.return_value.render.return_value = \
+                'changed'
+            assert init._render('upstart.conf') == rendered
+            assert not env.called
+            init.params['description'] = 'changed'
+            assert init._render('upstart.conf') == 'changed'
+
+    def test_render_cache_disabled(self):
+        init = self._get_implementation()
+        del os.environ['SERV_RENDER_CACHE']
+        init._render('upstart.conf')
+        assert not os.path.isdir(utils.get_cache_dir('render'))
+
+    @pytest.mark.skipif(utils.IS_WIN, reason='Irrelevant on Windows')
+    def test_permissions(self):
+        self._get_implementation()._render('upstart.conf')
+        render_dir = utils.get_cache_dir('render')
+        assert os.stat(render_dir).st_mode & 0o777 == 0o700
+        for name in os.listdir(render_dir):
+            path = os.path.join(render_dir, name)
+            assert os.stat(path).st_mode & 0o777 == 0o600
+
+    def test_eviction(self):
+        with mock.patch('serv.constants.RENDER_CACHE_MAX_ENTRIES', 10):
+            for i in range(11):
+                key = 'key{0}'.format(i)
+                cache.put(key, 'content')
+                path = os.path.join(utils.get_cache_dir('render'), key)
+                os.utime(path, (i, i))
+        assert set(os.listdir(utils.get_cache_dir('render'))) == \
+            set('key{0}'.format(i) for i in range(2, 11))
+        assert cache.get('key1') is None
+        assert cache.get('key10') == 'content'
+
+    def test_clear(self, cache_dir):
+        cache.put('key', 'content')
+        cache_dir.join('init-system.json').write('{}')
+        result = _invoke('cache_group clear')
+        assert result.exit_code == 0
+        assert utils.get_cache_dir('render') in result.output
+        assert cache_dir.listdir() == []
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='Requires -X importtime')
+class TestStartup:
+    # Cumulative import time budget, in microseconds, of serv.serv and
+    # everything it imports.
+    budget = 300000
+
+    def _get_import_times(self, *args):
+        code = ('import sys\n'
+                'from serv.serv import main\n'
+                'main({0!r})'.format(list(args)))
+        proc = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        _, err = proc.communicate()
+        import_times = {}
+        for line in err.decode('utf-8').splitlines():
+            if line.startswith('import time:') and '|' in line:
+                _, cumulative, module = line.split('|')
+                if cumulative.strip().isdigit():
+                    import_times[module.strip()] = int(cumulative)
+        assert 'serv.serv' in import_times
+        assert import_times['serv.serv'] < self.budget
+        return import_times
+
+    def test_help(self):
+        modules = self._get_import_times('--help')
+        for module in ('jinja2', 'distro', 'sh', 'yaml', 'serv.init.systemd'):
+            assert module not in modules
+
+    def test_stop(self):
+        modules = self._get_import_times(
+            'stop', 'testservice', '--init-system', 'sysv')
+        # Implementations import `sh` which is required to stop services.
+        assert 'sh' in modules
+        for module in ('jinja2', 'distro', 'yaml', 'serv.init.systemd'):
+            assert module not in modules
+
+
+class TestProfiling:
+    def teardown_method(self, _):
+        profiling.reset()
+
+    def test_disabled(self):
+        assert profiling.timer('render', 'x') is profiling.timer('y')
+        with profiling.timer('render', 'x'):
+            pass
+        assert not profiling.report()['records']
+
+    @mock.patch.object(profiling, '_enabled', True)
+    @mock.patch('serv.init.systemd.sh')
+    def test_enabled(self, _):
+        init = serv.Serv('systemd')._get_implementation('x')
+        init.restart()
+        init.restart()
+        with profiling.timer('render', 'systemd.service'):
+            pass
+        report = profiling.report('restart')
+        assert report['operation'] == 'restart'
+        assert report['phases']['systemctl']['count'] == 2
+        assert report['phases']['render']['count'] == 1
+        assert [(r['phase'], r['name']) for r in report['records']] == [
+            ('systemctl', 'restart x'),
+            ('systemctl', 'restart x'),
+            ('render', 'systemd.service')]
+        json.dumps(report)
+
+    @mock.patch.object(profiling, '_enabled', False)
+    def test_cli(self):
+        result = clicktest.CliRunner().invoke(
+            serv.main, ['--profile', 'status', '--init-system', 'sysv'])
+        # The report is printed after the status itself.
+        decoder = json.JSONDecoder()
+        output = result.output[result.output.index('{'):]
+        status, end = decoder.raw_decode(output)
+        assert status['init_system'] == 'sysv'
+        report = json.loads(output[end:])
+        assert report['operation'] == 'status'
+        assert 'total_ms' in report
+
+
+class TestProbes:
+    @pytest.mark.parametrize('probe, expected', [
+        ('tcp:8000', dict(type='tcp', host='127.0.0.1', port=8000)),
+        ('tcp:{name}.local:80', dict(type='tcp', host='web.local', port=80)),
+        ('http://localhost/{name}',
+         dict(type='http', url='http://localhost/web')),
+        ('unix:/run/{name}.sock', dict(type='unix', path='/run/web.sock')),
+        ('file:/tmp/ready', dict(type='file', path='/tmp/ready')),
+        ('cmd:test -f /tmp/{name}',
+         dict(type='cmd', command='test -f /tmp/web')),
+        (dict(type='tcp', port='80', timeout=5),
+         dict(type='tcp', host='127.0.0.1', port=80, timeout=5.0)),
+    ])
+    def test_parse(self, probe, expected):
+        expected.setdefault('timeout', float(constants.DEFAULT_WAIT_TIMEOUT))
+        assert probes.parse(probe, 'web') == expected
+
+    @pytest.mark.parametrize('probe, error', [
+        ('ftp://localhost', 'Probe type must be one of'),
+        ('tcp:localhost', 'A tcp probe must provide a port'),
+        (dict(type='file'), 'A file probe must provide a `path`'),
+    ])
+    def test_parse_invalid(self, probe, error):
+        with pytest.raises(exceptions.ServError) as ex:
+            probes.parse(probe)
+        assert error in str(ex)
+
+    def test_invalid_service_probe(self):
+        with pytest.raises(exceptions.ServError) as ex:
+            base.Base(init_sys='systemd', name='a', probe='tcp:')
+        assert 'A tcp probe must provide a port' in str(ex)
+
+    def test_tcp(self):
+        import socket
+
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        probe = probes.parse('tcp:{0}'.format(server.getsockname()[1]))
+        try:
+            assert probes.check(probe)
+        finally:
+            server.close()
+        assert not probes.check(probe)
+
+    def test_http(self):
+        import threading
+        try:
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+        except ImportError:
+            from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200 if self.path == '/ready' else 503)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://127.0.0.1:{0}/'.format(server.server_address[1])
+        try:
+            assert probes.check(probes.parse(url + 'ready'))
+            assert not probes.check(probes.parse(url + 'starting'))
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert not probes.check(probes.parse(url + 'ready'))
+
+    def test_http_bad_response(self):
+        import socket
+        import threading
+
+        # e.g. a service which is still starting.
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+
+        def respond():
+            connection, _ = server.accept()
+            connection.recv(1024)
+            connection.sendall(b'not http\r\n\r\n')
+            connection.close()
+
+        thread = threading.Thread(target=respond)
+        thread.daemon = True
+        thread.start()
+        try:
+            assert not probes.check(probes.parse(
+                'http://127.0.0.1:{0}/'.format(server.getsockname()[1])))
+        finally:
+            thread.join()
+            server.close()
+
+    def test_unix(self, tmpdir):
+        import socket
+
+        path = str(tmpdir.join('service.sock'))
+        probe = probes.parse('unix:' + path)
+        assert not probes.check(probe)
+        server = socket.socket(socket.AF_UNIX)
+        try:
+            server.bind(path)
+            assert probes.check(probe)
+        finally:
+            server.close()
+        tmpdir.join('file').write('')
+        assert not probes.check(probes.parse(
+            'unix:' + str(tmpdir.join('file'))))
+
+    def test_file_and_cmd(self, tmpdir):
+        path = str(tmpdir.join('ready'))
+        assert not probes.check(probes.parse('file:' + path))
+        assert not probes.check(probes.parse('cmd:test -f ' + path))
+        tmpdir.join('ready').write('')
+        assert probes.check(probes.parse('file:' + path))
+        assert probes.check(probes.parse('cmd:test -f ' + path))
+
+    def test_cmd_not_found(self):
+        with pytest.raises(exceptions.ServError) as ex:
+            probes.check(probes.parse('cmd:non_existing_executable'))
+        assert 'Failed to run probe command' in str(ex)
+
+    @mock.patch('time.sleep')
+    def test_wait(self, sleep, tmpdir):
+        path = tmpdir.join('ready')
+        checks = []
+
+        def check(probe):
+            checks.append(probe)
+            if len(checks) == 3:
+                path.write('')
+            return path.check()
+
+        with mock.patch.object(probes, 'check', side_effect=check):
+            probes.wait('file:' + str(path), 'web')
+        assert len(checks) == 3
+        # The interval between checks is backed off.
+        assert [c[0][0] for c in sleep.call_args_list] == [0.1, 0.2]
+
+    def test_wait_timeout(self, tmpdir):
+        probe = dict(type='file', path=str(tmpdir.join('x')), timeout=0.2)
+        with pytest.raises(exceptions.ServError) as ex:
+            probes.wait(probe, 'web')
+        assert 'Service web is not ready after 0.2 seconds ' \
+            '(file probe failed)' in str(ex)
+
+
+class TestBatch:
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_batch(self, sh):
+        client = serv.Serv('systemd')
+        with client.batch():
+            for name in ('a', 'b'):
+                init = client._get_implementation(name)
+                init.uninstall()
+                init.start()
+            assert not sh.systemctl.called
+        assert sh.systemctl.call_args_list == [
+            mock.call('disable', 'a', 'b'),
+            mock.call('daemon-reload'),
+            mock.call('start', 'a', 'b')]
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_batch_templates(self, sh):
+        client = serv.Serv('systemd')
+        with mock.patch('serv.init.systemd.SystemD.scale') as scale:
+            with client.batch():
+                for name in ('a@', 'b@'):
+                    client._get_implementation(name).uninstall()
+                assert not sh.systemctl.called
+        assert scale.call_args_list == [mock.call(0), mock.call(0)]
+        sh.systemctl.assert_called_once_with('daemon-reload')
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_no_batch(self, sh):
+        client = serv.Serv('systemd')
+        for name in ('a', 'b'):
+            client._get_implementation(name).uninstall()
+        assert sh.systemctl.call_args_list == [
+            mock.call('disable', 'a'), mock.call('daemon-reload'),
+            mock.call('disable', 'b'), mock.call('daemon-reload')]
+
+    @mock.patch('serv.init.systemd.sh')
+    def test_systemd_apply_starts_after_batch(self, sh):
+        client = serv.Serv('systemd')
+        executable = find_executable('python') or '/usr/bin/python2'
+        try:
+            with mock.patch.object(client, '_deploy'):
+                results = client.apply(
+                    [dict(cmd=executable, name='a')], start=True)
+        finally:
+            shutil.rmtree(utils.get_tmp_dir('systemd', 'a'),
+                          ignore_errors=True)
+        assert results[0]['started']
+        sh.systemctl.assert_called_once_with('start', 'a')
+
+    @mock.patch('serv.init.upstart.sh')
+    def test_upstart_batch(self, sh):
+        client = serv.Serv('upstart')
+        with client.batch():
+            with client.batch():
+                for name in ('a', 'b'):
+                    client._get_implementation(name).uninstall()
+            assert not sh.initctl.called
+        sh.initctl.assert_called_once_with('reload-configuration')
+
+
 class TestDeployMock:
     service_name = 'testservice'
     from . import mock_system
@@ -314,14 +1424,310 @@ class TestDeployMock:
             assert not os.path.isfile(destination_path + '.started')
             client.start(self.service_name)
             assert os.path.isfile(destination_path + '.started')
+            client.reload(self.service_name)
+            assert os.path.isfile(destination_path + '.reloaded')
             status = client.status(self.service_name)['services'][0]
             assert status['name'] == self.service_name
             assert status['started']
             assert status['installed']
+            statuses = client.status(
+                names=[self.service_name, 'other'])['services']
+            assert [s['installed'] for s in statuses] == [True, False]
             client.remove(self.service_name)
             assert not os.path.isfile(destination_path)
         finally:
             shutil.rmtree(
                 self.mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
 
+    def test_start_wait_timeout(self):
+        executable = find_executable('python') or '/usr/bin/python2'
+        client = serv.Serv('mock')
+        try:
+            client.generate(executable, self.service_name, deploy=True)
+            client.start(self.service_name, wait=True, timeout=1)
+            with mock.patch.object(
+                    self.mock_system.MockSystem, 'is_running') as is_running:
+                is_running.return_value = True
+                with pytest.raises(exceptions.ServError) as ex:
+                    client.stop(self.service_name, wait=True, timeout=0.2)
+            assert 'did not stop within 0.2 seconds' in str(ex)
+        finally:
+            shutil.rmtree(
+                self.mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
+
+    @pytest.mark.skipif(sys.version_info < (3, 5), reason='Requires asyncio')
+    def test_async_flow(self):
+        import asyncio
+        from serv.async_serv import AsyncServ
+
+        executable = find_executable('python') or '/usr/bin/python2'
+        client = AsyncServ('mock', concurrency=2)
+        names = ['{0}{1}'.format(self.service_name, i) for i in range(5)]
+
+        def run(action, **kwargs):
+            return loop.run_until_complete(asyncio.gather(
+                *[getattr(client, action)(name, **kwargs) for name in names],
+                return_exceptions=True))
+
+        def started(name):
+            return os.path.isfile(os.path.join(
+                self.mock_system.MOCK_INIT_SYSTEM_DIR, name + '.started'))
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(asyncio.gather(*[
+                client.generate(executable, name, deploy=True, start=True)
+                for name in names]))
+            assert all(started(name) for name in names)
+            run('stop', wait=True, timeout=5)
+            assert not any(started(name) for name in names)
+            run('restart', wait=True, timeout=5)
+            assert all(started(name) for name in names)
+            statuses = run('status')
+            assert all(s['services'][0]['started'] for s in statuses)
+            run('remove')
+            for ex in run('start'):
+                assert 'does not seem to be installed' in str(ex)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            shutil.rmtree(
+                self.mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
+
+    def test_apply(self):
+        executable = find_executable('python') or '/usr/bin/python2'
+        client = serv.Serv('mock')
+        names = ['{0}{1}'.format(self.service_name, i) for i in range(5)]
+        specs = [dict(cmd=executable, name=name) for name in names]
+        specs.append(dict(cmd='non_existing_executable', name='bad'))
+        try:
+            results = client.apply(specs, deploy=True, start=True, jobs=2)
+            assert sorted(r['name'] for r in results) == \
+                sorted(names + ['bad'])
+            for result in results:
+                started_file = os.path.join(
+                    self.mock_system.MOCK_INIT_SYSTEM_DIR,
+                    result['name'] + '.started')
+                if result['name'] == 'bad':
+                    assert 'could not be found' in result['error']
+                    assert not os.path.isfile(started_file)
+                else:
+                    assert not result['error']
+                    assert result['started']
+                    assert os.path.isfile(started_file)
+                    assert list(result['file_states'].values()) == \
+                        ['created']
+
+            # Redeploying unchanged services doesn't require overwriting.
+            results = client.apply(specs[:-1], deploy=True)
+            for result in results:
+                assert not result['error']
+                assert list(result['file_states'].values()) == \
+                    ['unchanged']
+        finally:
+            shutil.rmtree(
+                self.mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
+            for name in names + ['bad']:
+                shutil.rmtree(
+                    utils.get_tmp_dir('mock', name), ignore_errors=True)
+
+    def test_apply_duplicate_names(self):
+        client = serv.Serv('mock')
+        with pytest.raises(exceptions.ServError) as ex:
+            client.apply([dict(cmd='/bin/x'), dict(cmd='/usr/bin/x')])
+        assert 'Service x is defined more than once' in str(ex)
+
+    def test_apply_invalid_specs(self):
+        executable = find_executable('python') or '/usr/bin/python2'
+        specs = [
+            dict(name='nocmd'),
+            dict(cmd=executable, name='badvar', var=dict(KEY='value')),
+            dict(cmd=executable, name='dependent', requires='nocmd'),
+            dict(cmd=executable, name='valid'),
+        ]
+        client = serv.Serv('mock')
+        try:
+            results = dict((r['name'], r) for r in client.apply(
+                specs, deploy=True, start=True))
+        finally:
+            shutil.rmtree(
+                self.mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
+        assert sorted(results) == ['badvar', 'dependent', 'nocmd', 'valid']
+        assert 'All services must provide a `cmd`' in results['nocmd']['error']
+        assert results['badvar']['error']
+        for name in ('nocmd', 'badvar'):
+            assert not results[name]['deployed']
+            assert not results[name]['started']
+        assert results['dependent']['error'] == \
+            'Required services failed: nocmd'
+        assert results['valid']['started']
+        assert not results['valid']['error']
+
+    def _record_actions(self, actions):
+        """Patch the mock system to append the name of each service it
+        starts or stops to `actions`.
+        """
+        system = self.mock_system.MockSystem
+
+        def record(action):
+            perform = getattr(system, action)
+
+            def record_action(init):
+                actions.append((action, init.name))
+                perform(init)
+            return record_action
+
+        return mock.patch.multiple(
+            system, start=record('start'), stop=record('stop'))
+
+    def test_start_and_stop_all(self):
+        executable = find_executable('python') or '/usr/bin/python2'
+        specs = [
+            dict(cmd=executable, name='web', requires=['db'], after='cache'),
+            dict(cmd=executable, name='db'),
+            dict(cmd=executable, name='cache'),
+            dict(cmd=executable, name='proxy', requires='web'),
+        ]
+        client = serv.Serv('mock')
+        actions = []
+        try:
+            with self._record_actions(actions):
+                results = client.apply(specs, deploy=True, start=True)
+                assert not [r for r in results if r['error']]
+                client.stop_all(specs, wait=True)
+                client.start_all(specs, wait=True)
+        finally:
+            shutil.rmtree(
+                self.mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
+        assert [a for a, _ in actions] == ['start'] * 4 + ['stop'] * 4 + \
+            ['start'] * 4
+        for phase in (actions[:4], actions[8:], actions[7:3:-1]):
+            names = [name for _, name in phase]
+            assert names.index('db') < names.index('web')
+            assert names.index('cache') < names.index('web')
+            assert names.index('web') < names.index('proxy')
+
+    def _test_rolling_restart(self, health_cmd, actions):
+        executable = find_executable('python') or '/usr/bin/python2'
+        names = ['{0}{1}'.format(self.service_name, i) for i in range(5)]
+        client = serv.Serv('mock')
+        results = client.apply(
+            [dict(cmd=executable, name=name) for name in names],
+            deploy=True,
+            start=True)
+        assert not [r for r in results if r['error']]
+        with self._record_actions(actions):
+            with mock.patch.object(self.mock_system.MockSystem,
+                                   'list_services',
+                                   return_value=names) as list_services:
+                try:
+                    return client.rolling_restart(
+                        self.service_name + '*',
+                        max_unavailable=2,
+                        timeout=0.5,
+                        health_cmd=health_cmd)
+                finally:
+                    list_services.assert_called_once_with(
+                        self.service_name + '*')
+
+    def test_rolling_restart(self):
+        health_cmd = 'test -f {0}/{{name}}.started'.format(
+            self.mock_system.MOCK_INIT_SYSTEM_DIR)
+        actions = []
+        try:
+            restarted = self._test_rolling_restart(health_cmd, actions)
+        finally:
+            shutil.rmtree(
+                self.mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
+        assert restarted == ['{0}{1}'.format(self.service_name, i)
+                             for i in range(5)]
+        # A batch is only restarted once the previous one is running again.
+        assert len(actions) == 10
+        batches = [set(['testservice0', 'testservice1']),
+                   set(['testservice2', 'testservice3']),
+                   set(['testservice4'])]
+        for batch, offset in zip(batches, (0, 4, 8)):
+            assert set(name for _, name in
+                       actions[offset:offset + 2 * len(batch)]) == batch
+
+    def test_rolling_restart_unhealthy(self):
+        actions = []
+        try:
+            with pytest.raises(exceptions.ServError) as ex:
+                self._test_rolling_restart(
+                    'test {name} != testservice2', actions)
+        finally:
+            shutil.rmtree(
+                self.mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
+        assert 'Rollout aborted after restarting 2 of 5 services: ' \
+            'testservice2: Service testservice2 is not ready after 0.5 ' \
+            'seconds (cmd probe failed)' in str(ex)
+        assert len(actions) == 8
+        assert ('stop', 'testservice4') not in actions
+
+    def test_rolling_restart_no_services(self):
+        with mock.patch.object(self.mock_system.MockSystem, 'list_services',
+                               return_value=[]):
+            with pytest.raises(exceptions.ServError) as ex:
+                serv.Serv('mock').rolling_restart('missing-*')
+        assert 'No services match missing-*' in str(ex)
+
+    def test_apply_with_probe(self):
+        executable = find_executable('python') or '/usr/bin/python2'
+        started_file = os.path.join(
+            self.mock_system.MOCK_INIT_SYSTEM_DIR, '{name}.started')
+        specs = [
+            dict(cmd=executable, name='ready', probe='file:' + started_file),
+            dict(cmd=executable,
+                 name='not-ready',
+                 probe=dict(type='file', path=started_file + '.x',
+                            timeout=0.2)),
+        ]
+        try:
+            results = serv.Serv('mock').apply(specs, deploy=True, start=True)
+        finally:
+            shutil.rmtree(
+                self.mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
+        results = dict((r['name'], r) for r in results)
+        assert results['ready']['started']
+        assert not results['ready']['error']
+        assert not results['not-ready']['started']
+        assert 'Service not-ready is not ready after 0.2 seconds' in \
+            results['not-ready']['error']
+
+    def test_apply_failed_requirement(self):
+        executable = find_executable('python') or '/usr/bin/python2'
+        specs = [
+            dict(cmd='non_existing_executable', name='db'),
+            dict(cmd=executable, name='web', requires='db'),
+        ]
+        try:
+            results = serv.Serv('mock').apply(specs, deploy=True, start=True)
+            errors = dict((r['name'], r['error']) for r in results)
+            assert 'could not be found' in errors['db']
+            assert errors['web'] == 'Required services failed: db'
+        finally:
+            shutil.rmtree(
+                self.mock_system.MOCK_INIT_SYSTEM_DIR, ignore_errors=True)
+
+    def test_start_all_cycle(self):
+        specs = [dict(name='a', after='b'), dict(name='b', requires='a')]
+        with pytest.raises(exceptions.ServError) as ex:
+            serv.Serv('mock').start_all(specs)
+        assert 'circular dependencies: a, b' in str(ex)
+
+    def test_start_all_cli(self, tmpdir):
+        manifest = tmpdir.join('services.json')
+        manifest.write(json.dumps([dict(name='a')]))
+        with mock.patch.object(serv.Serv, 'start_all') as start_all:
+            result = _invoke('start --all --manifest {0} -j 2 '
+                             '--init-system sysv'.format(manifest))
+        assert result.exit_code == 0
+        start_all.assert_called_once_with(
+            [dict(name='a')], False, constants.DEFAULT_WAIT_TIMEOUT, 2)
+        result = _invoke('start --all --init-system sysv')
+        assert '`--all` requires a `--manifest`' in result.output
+
+
 # TODO: Test CLI using the mock system flow